@@ -1,152 +1,471 @@
-import copy
 import os
+import re
+import time
 
 from FormulaReader import FormulaNode, OperatorNode
+from tarjan import tarjan
 
 
-class BooleanEquation:
-
-    def __init__(self, sign, lhs, rhs):
-        self.sign = sign
-        self.lhs = lhs
-        self.rhs = simplify(rhs)
+# variables are integers: the variable of fixpoint i for state s is i * numstates + s
+#   variables introduced for nested right-hand sides get the integers after those
+# every right-hand side is a conjunction ("AND") or disjunction ("OR") of variables,
+#   where an empty conjunction is true and an empty disjunction is false
+# the rank of a variable is the index of its block of equations with the same sign,
+#   variables of the same rank may be solved in any order
+class BooleanEquationSystem:
 
+    def __init__(self, numvars, initVar):
+        self.names = [None] * numvars
+        self.signs = [None] * numvars
+        self.ranks = [None] * numvars
+        self.ops = [None] * numvars
+        self.operands = [None] * numvars
+        self.initVar = initVar
+
+    def setVariable(self, var, name, sign, rank):
+        self.names[var] = name
+        self.signs[var] = sign
+        self.ranks[var] = rank
+
+    def addVariable(self, name, sign, rank):
+        self.names += [name]
+        self.signs += [sign]
+        self.ranks += [rank]
+        self.ops += [None]
+        self.operands += [None]
+        return len(self.names) - 1
+
+    # the equations in the order of their rank, followed by the initial variable, in the format read by readBES
     def __repr__(self):
-        return self.sign + ' ' + self.lhs + ' = ' + str(self.rhs)
+        lines = []
+        for var in sorted((var for var in range(len(self.ops)) if self.ops[var] is not None),
+                          key=lambda var: (self.ranks[var], var)):
+            operands = [self.names[child] for child in self.operands[var]]
+            if not operands:
+                rhs = "1.0" if self.ops[var] == "AND" else "0.0"
+            elif len(operands) == 1:
+                rhs = operands[0]
+            else:
+                rhs = '(' + (" && " if self.ops[var] == "AND" else " || ").join(operands) + ')'
+            lines += [self.signs[var] + ' ' + self.names[var] + ' = ' + rhs]
+        return '\n'.join(lines) + '\ninit ' + self.names[self.initVar]
 
 
-class BooleanEquationSystem:
+model = None
+printInfo = False
+# the fixpoint variables in the order of the formula and their index
+fixpointVars = []
+fixpointIndex = {}
 
-    def __init__(self, equations):
-        self.equations = equations
+# a right-hand side while it is created is a variable or a pair of an operator and a tuple of right-hand sides
+TRUE = ("AND", ())
+FALSE = ("OR", ())
 
-    def __repr__(self):
-        return '\n'.join(str(e) for e in self.equations)
 
+def indexFixpoints(fixpoints):
+    global fixpointVars, fixpointIndex
+    fixpointVars = [fixf.op.var for fixf in fixpoints]
+    fixpointIndex = {var: i for i, var in enumerate(fixpointVars)}
 
-model = None
-printInfo = False
+
+# gives the readable name of a fixpoint variable, such as X12 for fixpoint variable X and state 12
+def varName(var):
+    return fixpointVars[var // model.numstates] + str(var % model.numstates)
+
+
+# combines right-hand sides with operator op, where operands with the same operator are merged,
+#   unit elements are left out and zero elements decide the result
+def makeRHS(op, operands):
+    flat = []
+    for operand in operands:
+        if type(operand) is int:
+            flat += [operand]
+        elif operand[0] == op:
+            flat += operand[1]
+        elif not operand[1]:
+            return operand
+        else:
+            flat += [operand]
+    # remove duplicate operands
+    flat = tuple(dict.fromkeys(flat))
+    if len(flat) == 1:
+        return flat[0]
+    return op, flat
 
 
 # creates the right-hand side of a boolean equation
 def RHS(state, formula):
 
-    # in case operator is VAL, we just return itself
-    newFormula = formula
+    # in case operator is VAL, true or false
+    if formula.op.type == "VAL":
+        return TRUE if formula.op.val == 1 else FALSE
 
     # in case variable or fixpoint, its just a variable
-    if formula.op.type in ["VAR", "LEASTFP", "GREATESTFP"]:
-        newVar = [formula.op.var + str(state)]
-        newFormula = FormulaNode([OperatorNode(newVar, "VAR")])
+    elif formula.op.type in ["VAR", "LEASTFP", "GREATESTFP"]:
+        return fixpointIndex[formula.op.var] * model.numstates + state
 
     # in case binary (OR, AND, PRODUCT, COPRODUCT, TCOSUM, TSUM) use corresponding boolean operator (OR, AND)
     elif formula.type == "BINARY":
         op = "OR" if formula.op.type in ["OR", "COPRODUCT", "TSUM"] else "AND"
-        subformulas = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        newFormula = FormulaNode([[subformulas[0], OperatorNode([], op), subformulas[1]]])
+        return makeRHS(op, (RHS(state, formula.subformulas[0]), RHS(state, formula.subformulas[1])))
 
-    # in case diamond or box, create formula with subformula for each outgoing transition with given action
+    # in case diamond or box, a disjunction (diamond) or conjunction (box) over the transitions with the given action
+    #   taken straight from the transition arrays, in case no transitions this is false (diamond) or true (box)
     elif formula.op.type in ["DIAMOND", "BOX"]:
-        subformulas = [RHS(t.enddist.keys()[0], formula.subformulas[0]) for t in model.outgoing(state, formula.op.action)]
-
-        # in case no transitions, return 0 if diamond, else 1
-        if not subformulas:
-            return FormulaNode([OperatorNode(["0"] if formula.op.type == "DIAMOND" else ["1"], "VAL")])
-
-        # in case one transition, return that RHS
-        elif len(subformulas) == 1:
-            return subformulas[0]
-
-        # in case more than one transition, create disjunction if diamond, else conjunction (from left to right)
-        else:
-            op = "OR" if formula.op.type == "DIAMOND" else "AND"
-            newFormula = subformulas[0]
-            for i in range(1, len(subformulas)):
-                newFormula = FormulaNode([[newFormula, OperatorNode([], op), subformulas[i]]])
-
-    return newFormula
+        op = "OR" if formula.op.type == "DIAMOND" else "AND"
+        aid = model.actionIds.get(formula.op.action)
+        start, end = (0, 0) if aid is None else model.actionIndex.get(state * len(model.actions) + aid, (0, 0))
+        subformula = formula.subformulas[0]
+        if subformula.op.type == "VAR":
+            offset = fixpointIndex[subformula.op.var] * model.numstates
+            return makeRHS(op, [offset + model.targets[model.distStart[t]] for t in range(start, end)])
+        return makeRHS(op, [RHS(model.targets[model.distStart[t]], subformula) for t in range(start, end)])
+
+
+# sets the right-hand side of var in bes to rhs, operands that are not a variable become new variables
+def addRHS(bes, var, rhs):
+    if type(rhs) is int:
+        rhs = ("OR", (rhs,))
+    operands = []
+    for operand in rhs[1]:
+        if type(operand) is not int:
+            newVar = bes.addVariable(bes.names[var] + "-" + str(len(operands)), bes.signs[var], bes.ranks[var])
+            addRHS(bes, newVar, operand)
+            operand = newVar
+        operands += [operand]
+    bes.ops[var] = rhs[0]
+    bes.operands[var] = operands
+
+
+# alters the formula so that it starts with a fixpoint operator
+#   and gives the fixpoints with their sign and rank
+def fixpointBlocks(formula):
+    if formula.op.type not in ["LEASTFP", "GREATESTFP"]:
+        formula = FormulaNode([[OperatorNode([OperatorNode(["Q"], "VAR")], "LEASTFP"), formula]])
+    fixpoints = formula.getSubFormulas(["LEASTFP", "GREATESTFP"])
+    signs = ['mu' if fix.op.type == "LEASTFP" else 'nu' for fix in fixpoints]
+    varRank = [0] * len(fixpoints)
+    for i in range(1, len(fixpoints)):
+        varRank[i] = varRank[i - 1] + (1 if signs[i] != signs[i - 1] else 0)
+    return fixpoints, signs, varRank
 
 
 def createBES(formula):
-    fixpoints = formula.getSubFormulas(["LEASTFP", "GREATESTFP"])
-    equations = []
-    for fixf in fixpoints:
-        sign = "mu" if fixf.op.type == "LEASTFP" else "nu"
+    fixpoints, signs, varRank = fixpointBlocks(formula)
+    indexFixpoints(fixpoints)
+    bes = BooleanEquationSystem(len(fixpoints) * model.numstates, model.initstate)
+    for fixIndex, fixf in enumerate(fixpoints):
         for state in range(0, model.numstates):
-            equations += [BooleanEquation(sign, fixf.op.var + str(state), RHS(state, fixf.subformulas[0]))]
-
-    return BooleanEquationSystem(equations)
-
-
-# applies boolean simplifications
-def simplify(formula):
-    for i in range(0, len(formula.subformulas)):
-        formula.subformulas[i] = simplify(formula.subformulas[i])
-
-    if formula.type is "BINARY":
-
-        subfVars = [subf.op.var for subf in formula.subformulas if subf.op.type == "VAR"]
-        subfIsFalse = [subf.op.type == "VAL" and subf.op.val == 0 for subf in formula.subformulas]
-        subfIsTrue = [subf.op.type == "VAL" and subf.op.val == 1 for subf in formula.subformulas]
-
-        # idempotence
-        if len(subfVars) == 2 and subfVars[0] == subfVars[1]:
-            return formula.subformulas[0]
-
-        # zero and unit element for AND
-        if formula.op.type in ["AND", "PRODUCT", "TCOSUM"]:
-            if any(subfIsFalse):
-                return FormulaNode([OperatorNode(["0"], "VAL")])
-            elif any(subfIsTrue):
-                return formula.subformulas[0] if subfIsTrue[1] else formula.subformulas[1]
-        # zero and unit element for OR
+            var = fixIndex * model.numstates + state
+            bes.setVariable(var, varName(var), signs[fixIndex], varRank[fixIndex])
+            addRHS(bes, var, RHS(state, fixf.subformulas[0]))
+
+    return bes
+
+
+# creates the BES of formula from the initial variable, only generating the equations of variables that are needed,
+#   and returns it together with the values that are already known
+# the value of a variable is known once its right-hand side is, regardless of its sign: a disjunction is true once one
+#   operand is true and false once all are false (dually for a conjunction); these values are propagated to the
+#   variables depending on them while generating, and unless complete, generation stops once the initial variable
+#   has a value, and the equations of variables with a value are not generated
+def createLocalBES(formula, complete):
+    fixpoints, signs, varRank = fixpointBlocks(formula)
+    indexFixpoints(fixpoints)
+    numvars = len(fixpoints) * model.numstates
+
+    initVar = model.initstate
+    bes = BooleanEquationSystem(numvars, initVar)
+    value = {}
+    # the variables depending on a variable without a value, and the number of operands without a value
+    parents = {}
+    count = {}
+
+    # gives var the value val and propagates it to the variables depending on it
+    def setValue(var, val):
+        stack = [(var, val)]
+        while stack:
+            var, val = stack.pop()
+            if var in value:
+                continue
+            value[var] = val
+            for parent in parents.pop(var, []):
+                if parent in value:
+                    continue
+                # true decides a disjunction and false a conjunction, else all operands have the same value
+                if val == (bes.ops[parent] == "OR"):
+                    stack += [(parent, val)]
+                else:
+                    count[parent] -= 1
+                    if count[parent] == 0:
+                        stack += [(parent, val)]
+
+    varQueue = [initVar]
+    queued = bytearray(numvars)
+    queued[initVar] = 1
+    varQueuePointer = 0
+    while varQueuePointer < len(varQueue) and (complete or initVar not in value):
+        var = varQueue[varQueuePointer]
+        varQueuePointer += 1
+        if var in value and not complete:
+            continue
+        fixIndex, state = divmod(var, model.numstates)
+        bes.setVariable(var, varName(var), signs[fixIndex], varRank[fixIndex])
+        numAux = len(bes.ops)
+        addRHS(bes, var, RHS(state, fixpoints[fixIndex].subformulas[0]))
+
+        # the new auxiliary variables only depend on auxiliary variables created after them
+        for newVar in list(reversed(range(numAux, len(bes.ops)))) + [var]:
+            operands = bes.operands[newVar]
+            absorbing = bes.ops[newVar] == "OR"
+            if any(value.get(child) == absorbing for child in operands):
+                setValue(newVar, absorbing)
+                continue
+            unknown = [child for child in operands if child not in value]
+            count[newVar] = len(unknown)
+            for child in unknown:
+                parents.setdefault(child, []).append(newVar)
+                if child < numvars and not queued[child]:
+                    queued[child] = 1
+                    varQueue += [child]
+            if not unknown:
+                setValue(newVar, not absorbing)
+
+    if printInfo:
+        print("##### created " + str(varQueuePointer) + " equations, " + str(len(value)) + " variables have a value")
+
+    return bes, value
+
+
+# a token of a right-hand side in a stored BES
+TOKEN = re.compile(r'\s*(?:(\(|\)|&&|\|\|)|([01](?:\.0*)?)(?![\w\-])|([a-zA-Z_][\w\-]*))')
+
+
+# parses a right-hand side in a stored BES, where ids gives the integer of every variable
+# returns the right-hand side or an error message
+def parseRHS(text, ids):
+    # the operands and operator of every open pair of parentheses
+    stack = [[[], None]]
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            return "unexpected '" + text[position:].strip() + "'"
+        position = match.end()
+        symbol, val, var = match.groups()
+        if symbol == '(':
+            stack += [[[], None]]
+        elif symbol == ')':
+            if len(stack) == 1:
+                return "unexpected ')'"
+            operands, op = stack.pop()
+            stack[-1][0] += [makeRHS(op or "OR", operands)]
+        elif symbol is not None:
+            op = "AND" if symbol == "&&" else "OR"
+            if stack[-1][1] not in [None, op]:
+                return "mixing && and || requires parentheses"
+            stack[-1][1] = op
+        elif val is not None:
+            stack[-1][0] += [TRUE if float(val) == 1 else FALSE]
+        elif var not in ids:
+            return "variable " + var + " has no equation"
         else:
-            if any(subfIsTrue):
-                return FormulaNode([OperatorNode(["1"], "VAL")])
-            elif any(subfIsFalse):
-                return formula.subformulas[0] if subfIsFalse[1] else formula.subformulas[1]
-
-    return formula
+            stack[-1][0] += [ids[var]]
+    if len(stack) > 1:
+        return "missing ')'"
+    operands, op = stack[0]
+    if not operands:
+        return "missing right-hand side"
+    return makeRHS(op or "OR", operands)
+
+
+# reads a BES as stored with -s: one equation 'mu X = f' or 'nu X = f' per line and optionally a line 'init X'
+#   with the variable whose value is the solution, by default the first one
+def readBES(filename):
+
+    try:
+        f = open(filename)
+        lines = f.read().split('\n')
+        f.close()
+    except IOError:
+        print("File '" + filename + "' not found")
+        return -1
 
+    equations = []
+    initName = None
+    for line in lines:
+        if len(line.strip()) == 0 or line.startswith('%'):
+            continue
+        if line.startswith("init "):
+            initName = line[5:].strip()
+            continue
+        match = re.match(r'\s*(mu|nu)\s+(\S+)\s*=\s*(.*)$', line)
+        if match is None:
+            print("Not an equation: " + line)
+            return -1
+        equations += [match.groups()]
+
+    if not equations:
+        print("No equations in '" + filename + "'")
+        return -1
+    ids = {name: var for var, (sign, name, rhs) in enumerate(equations)}
+    if initName is not None and initName not in ids:
+        print("Initial variable " + initName + " has no equation")
+        return -1
+
+    bes = BooleanEquationSystem(len(equations), ids[initName] if initName is not None else 0)
+    rank = 0
+    for var, (sign, name, rhs) in enumerate(equations):
+        if var > 0 and sign != equations[var - 1][0]:
+            rank += 1
+        bes.setVariable(var, name, sign, rank)
+    for var, (sign, name, text) in enumerate(equations):
+        rhs = parseRHS(text, ids)
+        if isinstance(rhs, str):
+            print("In the equation of " + name + ": " + rhs)
+            return -1
+        addRHS(bes, var, rhs)
+    return bes
+
+
+# gives the value of the right-hand side of var given the values of its operands
+def evaluate(bes, var, value):
+    if bes.ops[var] == "OR":
+        return any(value[child] for child in bes.operands[var])
+    return all(value[child] for child in bes.operands[var])
+
+
+# solves an SCC in which all variables have the same sign with a worklist, in time linear in its size
+# for mu, all variables start false and become true once their right-hand side is true (dually for nu)
+def solveAlternationFree(bes, SCC, value):
+    isMu = bes.signs[SCC[0]] == "mu"
+    inSCC = set(SCC)
+    parents = {var: [] for var in SCC}
+    # the number of operands that still have to change before a variable changes, -1 if it never will
+    count = {}
+    worklist = []
+    for var in SCC:
+        internal = [child for child in bes.operands[var] if child in inSCC]
+        external = [value[child] == isMu for child in bes.operands[var] if child not in inSCC]
+        for child in internal:
+            parents[child] += [var]
+        # for mu, a disjunction changes when one operand does and a conjunction when all do (dually for nu)
+        if (bes.ops[var] == "OR") == isMu:
+            count[var] = 0 if any(external) else 1
+        else:
+            count[var] = len(internal) if all(external) else -1
+        if count[var] == 0:
+            worklist += [var]
+
+    for var in SCC:
+        value[var] = not isMu
+    while worklist:
+        var = worklist.pop()
+        value[var] = isMu
+        for parent in parents[var]:
+            if count[parent] > 0:
+                count[parent] -= 1
+                if count[parent] == 0:
+                    worklist += [parent]
+
+
+# solves an SCC with variables of both signs by nested fixpoint iteration: the variables of the lowest rank start
+#   false (mu) or true (nu), the other variables are solved given these values, after which the variables of the
+#   lowest rank are evaluated again, until they no longer change
+# since the values only change in one direction, this takes at most one round per variable of the lowest rank
+def solveAlternating(bes, SCC, value):
+    rank = min(bes.ranks[var] for var in SCC)
+    outer = [var for var in SCC if bes.ranks[var] == rank]
+    inner = [var for var in SCC if bes.ranks[var] != rank]
+    isMu = bes.signs[outer[0]] == "mu"
+    for var in outer:
+        value[var] = not isMu
+    changed = True
+    while changed:
+        solveVariables(bes, inner, value)
+        changed = False
+        for var in outer:
+            if evaluate(bes, var, value) == isMu and value[var] != isMu:
+                value[var] = isMu
+                changed = True
+
+
+# solves 'variables', given the values of the variables outside it they depend on, one SCC at a time
+#   SCCs with variables of one sign are solved with a worklist, others by nested iteration
+def solveVariables(bes, variables, value):
+    inVariables = set(variables)
+    depChildren = {var: [child for child in bes.operands[var] if child in inVariables] for var in variables}
+
+    # tarjan's algorithm gives the SCC's in reverse topological order, so every SCC only depends on solved SCC's
+    for SCC in tarjan(depChildren):
+        if len(set(bes.signs[var] for var in SCC)) == 1:
+            solveAlternationFree(bes, SCC, value)
+        else:
+            if printInfo:
+                print("##### solving SCC of " + str(len(SCC)) + " variables by nested iteration")
+            solveAlternating(bes, SCC, value)
+
+
+# solves the variables the initial variable depends on, variables in 'value' are already solved
+def solveBES(bes, value=None):
+    if value is None:
+        value = {}
+    if bes.initVar in value:
+        return value[bes.initVar]
+
+    # the variables the initial variable depends on, in breadth first order
+    variables = [bes.initVar]
+    found = {bes.initVar}
+    for var in variables:
+        for child in bes.operands[var]:
+            if child not in found and child not in value:
+                found.add(child)
+                variables += [child]
+    if printInfo:
+        print("##### solving " + str(len(variables)) + " variables")
+
+    solveVariables(bes, variables, value)
+    return value[bes.initVar]
+
+
+# if local, the BES is created from the initial variable, see createLocalBES
+def initBESSolver(ts, formula, store, verbose, local=False):
+    global model, printInfo
+    model = ts
+    printInfo = verbose
 
-# substitutes a formula 'new' for a variable 'var'
-def substituteVar(formula, var, new):
-    # print("substituting " + str(var) + " for " + str(new) + " in " + str(formula))
-    if formula.op.type == "VAR" and formula.op.var == var:
-        # not using copy is not wrong, but it is ugly
-        # without it this will also substitute in equations below sometimes due to same reference
-        return copy.deepcopy(new)
+    createStart = time.clock()
+    if local:
+        bes, values = createLocalBES(formula, store)
     else:
-        for i in range(0, len(formula.subformulas)):
-            formula.subformulas[i] = substituteVar(formula.subformulas[i], var, new)
-    return formula
+        bes, values = createBES(formula), None
+    createEnd = time.clock()
 
+    if store:
+        f = open(os.path.sep.join([os.path.split(model.file)[0], model.name + "_" + formula.name + "_BES"
+                                   + ("_local" if local else "") + ".bes"]), 'w')
+        f.write(str(bes))
+        f.close()
 
-# solves BES using Gauss elimination
-def solveBES(bes):
-    for i in reversed(range(0, len(bes.equations))):
-        equation = bes.equations[i]
-        var = equation.lhs
-        equation.rhs = substituteVar(equation.rhs, var, FormulaNode([OperatorNode(["0"] if equation.sign == "mu" else ["1"], "VAL")]))
-        equation.rhs = simplify(equation.rhs)
-        for j in reversed(range(0, i)):
-            bes.equations[j].rhs = substituteVar(bes.equations[j].rhs, var, equation.rhs)
-        if printInfo:
-            print(str(bes) + '\n')
+    solveStart = time.clock()
+    value = solveBES(bes, values)
+    solveEnd = time.clock()
 
-    return bool(bes.equations[0].rhs.op.val)
+    return value, createEnd - createStart, solveEnd - solveStart
 
 
-def initBESSolver(ts, formula, store, verbose):
-    global model, printInfo
-    model = ts
+# solves a BES stored with -s, returns the initial variable, its value and the solving time (None if it cannot be read)
+def initStoredBESSolver(filename, verbose):
+    global printInfo
     printInfo = verbose
 
-    bes = createBES(formula)
+    bes = readBES(filename)
+    if bes == -1:
+        return None
 
-    if store:
-        f = open(os.path.sep.join([os.path.split(model.file)[0], model.name + "_" + formula.name + "_BES.bes"]), 'w')
-        f.write(str(bes))
-        f.close()
+    solveStart = time.clock()
+    value = solveBES(bes)
+    solveEnd = time.clock()
 
-    return solveBES(bes)
+    return bes.names[bes.initVar], value, solveEnd - solveStart
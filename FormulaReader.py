@@ -28,14 +28,17 @@ class FormulaNode:
     def isClosed(self):
         return len(self.vars) == len(self.closedVars)
 
+    # iterates over this formula and its subformulas in prefix order
+    def iterSubFormulas(self):
+        stack = [self]
+        while stack:
+            f = stack.pop()
+            yield f
+            stack += reversed(f.subformulas)
+
     # gets all subformulas with operator type in 'optypes'
     def getSubFormulas(self, optypes):
-        subf = []
-        if self.op.type in optypes:
-            subf += [self]
-        for f in self.subformulas:
-            subf += f.getSubFormulas(optypes)
-        return subf
+        return [f for f in self.iterSubFormulas() if f.op.type in optypes]
 
     def toObjectString(self):
         if self.type == "NULLARY":
@@ -119,7 +122,7 @@ def grammar():
     PROB = Regex("1|0(\.[0-9]*)?")
 
     VAL = PROB.setParseAction(lambda tokens: OperatorNode(tokens, "VAL"))
-    VAR = Regex("[A-Z]").setParseAction(lambda tokens: OperatorNode(tokens, "VAR"))
+    VAR = Regex("[A-Z][a-zA-Z_]*").setParseAction(lambda tokens: OperatorNode(tokens, "VAR"))
     LABEL = Literal("l").setParseAction(lambda tokens: OperatorNode(tokens, "LABEL"))
     AND = Literal("&&").suppress().setParseAction(lambda tokens: OperatorNode(tokens, "AND"))
     OR = Literal("||").suppress().setParseAction(lambda tokens: OperatorNode(tokens, "OR"))
@@ -0,0 +1,299 @@
+import numpy as np
+from RealFormula import *
+from tarjan import tarjan
+
+# a choice only replaces the current one in policy iteration if it is better by more than PRECISION
+PRECISION = 1e-12
+# the maximum number of policy improvements before giving up
+MAX_POLICIES = 1000
+# policies of at most DENSE_LIMIT variables are evaluated by a dense linear solve, larger ones by iteration
+DENSE_LIMIT = 2000
+# iterative policy evaluation stops when no value changes more than EVAL_PRECISION
+EVAL_PRECISION = 1e-14
+# value iteration of an SCC stops when the bounds are closer than EPSILON or no longer change more than EPSILON
+EPSILON = 1e-10
+# the maximum number of iterations of value iteration of an SCC, and of every rank in nested value iteration
+MAXITER = 1000
+# the factor by which the precision of every inner rank in nested value iteration is smaller, down to MIN_PRECISION
+INNER_PRECISION = 0.01
+MIN_PRECISION = 1e-15
+
+printInfo = False
+# the number of SCCs solved by value iteration and the total number of iterations
+iterations = 0
+sccs = 0
+
+
+# the right-hand sides of a set of equations in normal form max{min{c + sum{p*X}}} as arrays,
+#   such that they can be evaluated for all equations at once
+#   termConst gives per linear term its constant, entryTerm, entryTarget and entryProb its variable-scalar pairs
+#   groupStart gives the index of the first term of every minimum, varGroupStart the first minimum of every equation
+#   varTermStart gives the index of the first term of every equation (and the number of terms as last element) and
+#   termVar the equation of every term
+# index gives the position of every variable in the values the right-hand sides are evaluated on, by default the
+#   variable itself, variables that are not in index get position -1
+class CompiledRHS:
+    def __init__(self, equations, index=None):
+        termConst = []
+        entryTerm = []
+        entryTarget = []
+        entryProb = []
+        groupStart = []
+        varGroupStart = []
+        for eq in equations:
+            varGroupStart += [len(groupStart)]
+            groups = eq.rhs.operands if eq.rhs.op.type == "MAXIMUM" else [eq.rhs]
+            for group in groups:
+                groupStart += [len(termConst)]
+                for operand in (group.operands if group.op.type == "MINIMUM" else [group]):
+                    term = toLinearTerm(operand)
+                    for var, p in term.coefficients.items():
+                        entryTerm += [len(termConst)]
+                        entryTarget += [var if index is None else index.get(var, -1)]
+                        entryProb += [p]
+                    termConst += [term.constant]
+        self.numvars = len(equations)
+        self.termConst = np.array(termConst, dtype=float)
+        self.entryTerm = np.array(entryTerm, dtype=int)
+        self.entryTarget = np.array(entryTarget, dtype=int)
+        self.entryProb = np.array(entryProb, dtype=float)
+        self.groupStart = np.array(groupStart, dtype=int)
+        self.varGroupStart = np.array(varGroupStart, dtype=int)
+        self.varTermStart = np.append(self.groupStart[self.varGroupStart], len(termConst))
+        self.termVar = np.repeat(np.arange(self.numvars), np.diff(self.varTermStart))
+
+    # evaluates all linear terms, where values gives the value of every variable
+    def evaluateTerms(self, values):
+        return self.termConst + np.bincount(self.entryTerm, weights=self.entryProb * values[self.entryTarget],
+                                            minlength=len(self.termConst))
+
+    # evaluates all right-hand sides, where values gives the value of every variable
+    def evaluate(self, values):
+        return np.maximum.reduceat(np.minimum.reduceat(self.evaluateTerms(values), self.groupStart), self.varGroupStart)
+
+
+# returns whether the equations of an SCC, compiled with the index of their variables in rhs, can be solved by policy
+#   iteration as a maximum system, or None if they do not fit
+# all equations must have the same sign, their right-hand sides must be a maximum (or all a minimum) of linear terms in
+#   the variables of the SCC, and every term c + sum{p*X} must have c >= 0, p >= 0 and c + sum{p} <= 1, such that all
+#   values are in [0,1]
+# for greatest fixpoints the system for the complements 1 - X is solved, in which maximum and minimum are swapped
+def policySystemShape(equations, rhs):
+    sign = equations[0].sign
+    if any(eq.sign != sign for eq in equations):
+        return None
+    total = rhs.termConst + np.bincount(rhs.entryTerm, weights=rhs.entryProb, minlength=len(rhs.termConst))
+    if np.any(rhs.entryTarget < 0) or np.any(rhs.entryProb < 0.0) or np.any(rhs.termConst < 0.0) \
+            or np.any(total > 1.0 + PRECISION):
+        return None
+    if np.all(np.diff(np.append(rhs.groupStart, len(rhs.termConst))) == 1):
+        isMaximum = True
+    elif np.all(np.diff(np.append(rhs.varGroupStart, len(rhs.groupStart))) == 1):
+        isMaximum = False
+    else:
+        return None
+    return isMaximum if sign == "mu" else not isMaximum
+
+
+# returns the variables whose least solution is certainly 0, using only the graph of the system
+#   for a maximum system these are the variables that cannot reach a positive constant
+#   for a minimum system these are the variables that have a choice to avoid positive constants forever
+def zeroVariables(rhs, isMax):
+    numTerms = len(rhs.termConst)
+    if isMax:
+        positive = np.zeros(rhs.numvars, dtype=bool)
+        while True:
+            reaches = np.bincount(rhs.entryTerm, weights=positive[rhs.entryTarget], minlength=numTerms) > 0
+            newPositive = np.bincount(rhs.termVar, weights=reaches | (rhs.termConst > 0.0), minlength=rhs.numvars) > 0
+            if np.array_equal(newPositive, positive):
+                return ~positive
+            positive = newPositive
+    else:
+        zero = np.ones(rhs.numvars, dtype=bool)
+        while True:
+            leaves = np.bincount(rhs.entryTerm, weights=~zero[rhs.entryTarget], minlength=numTerms) > 0
+            newZero = np.bincount(rhs.termVar, weights=~leaves & (rhs.termConst <= 0.0), minlength=rhs.numvars) > 0
+            if np.array_equal(newZero, zero):
+                return zero
+            zero = newZero
+
+
+# gives the least solution of the linear system X = c + P X of a policy (the chosen term of every variable), where the
+#   variables in 'zero' are fixed to 0
+# values is the solution of the previous policy, used as starting point for iterative evaluation
+def evaluatePolicy(rhs, policy, zero, values):
+    chosen = np.zeros(len(rhs.termConst), dtype=bool)
+    chosen[policy] = True
+    entries = np.flatnonzero(chosen[rhs.entryTerm] & ~zero[rhs.termVar[rhs.entryTerm]])
+    rows = rhs.termVar[rhs.entryTerm[entries]]
+    cols = rhs.entryTarget[entries]
+    probs = rhs.entryProb[entries]
+    const = np.where(zero, 0.0, rhs.termConst[policy])
+
+    # only variables that can reach a positive constant get a positive value, for the others the system is singular
+    predecessors = [[] for i in range(rhs.numvars)]
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        if not zero[col]:
+            predecessors[col] += [row]
+    positive = const > 0.0
+    queue = np.flatnonzero(positive).tolist()
+    while queue:
+        var = queue.pop()
+        for pred in predecessors[var]:
+            if not positive[pred]:
+                positive[pred] = True
+                queue += [pred]
+
+    newValues = np.zeros(rhs.numvars)
+    vars = np.flatnonzero(positive)
+    if len(vars) == 0:
+        return newValues
+    local = np.full(rhs.numvars, -1)
+    local[vars] = np.arange(len(vars))
+    keep = positive[rows] & positive[cols]
+    rows, cols, probs = local[rows[keep]], local[cols[keep]], probs[keep]
+    if len(vars) <= DENSE_LIMIT:
+        matrix = np.identity(len(vars))
+        np.add.at(matrix, (rows, cols), -probs)
+        newValues[vars] = np.linalg.solve(matrix, const[vars])
+    else:
+        x = values[vars].copy()
+        residual = 1.0
+        while residual > EVAL_PRECISION:
+            newX = const[vars] + np.bincount(rows, weights=probs * x[cols], minlength=len(vars))
+            residual = np.max(np.abs(newX - x))
+            x = newX
+        newValues[vars] = x
+    return newValues
+
+
+# solves the equations of an SCC of the dependency graph at once by policy iteration, see policySystemShape
+# returns {variable: value}, or None if the equations do not fit
+def solveSCC(equations):
+    rhs = CompiledRHS(equations, {eq.lhs: i for i, eq in enumerate(equations)})
+    isMax = policySystemShape(equations, rhs)
+    if isMax is None:
+        return None
+    isNu = equations[0].sign == "nu"
+    if isNu:
+        # for X = c + sum{p*Y} the complement is 1 - X = (1 - c - sum{p}) + sum{p*(1 - Y)}
+        rhs.termConst = np.maximum(0.0, 1.0 - rhs.termConst - np.bincount(rhs.entryTerm, weights=rhs.entryProb,
+                                                                           minlength=len(rhs.termConst)))
+    zero = zeroVariables(rhs, isMax)
+
+    # start with the terms with the best constant
+    policy = np.empty(rhs.numvars, dtype=int)
+    for var in range(rhs.numvars):
+        start, end = rhs.varTermStart[var], rhs.varTermStart[var + 1]
+        consts = rhs.termConst[start:end]
+        policy[var] = start + (np.argmax(consts) if isMax else np.argmin(consts))
+
+    values = np.zeros(rhs.numvars)
+    for i in range(MAX_POLICIES):
+        values = evaluatePolicy(rhs, policy, zero, values)
+        termValues = rhs.evaluateTerms(values)
+        # only switch to a term that is strictly better, otherwise policy iteration may not terminate
+        if isMax:
+            improves = termValues > values[rhs.termVar] + PRECISION
+        else:
+            improves = termValues < values[rhs.termVar] - PRECISION
+        improves &= ~zero[rhs.termVar]
+        improvedVars = np.unique(rhs.termVar[improves])
+        if printInfo:
+            print("policy " + str(i) + ": " + str(len(improvedVars)) + " variables improved")
+        if len(improvedVars) == 0:
+            break
+        for var in improvedVars:
+            start, end = rhs.varTermStart[var], rhs.varTermStart[var + 1]
+            best = np.argmax(termValues[start:end]) if isMax else np.argmin(termValues[start:end])
+            policy[var] = start + best
+    else:
+        return None
+
+    if isNu:
+        values = 1.0 - values
+    return {eq.lhs: float(value) for eq, value in zip(equations, values)}
+
+
+# approximates the nested fixpoints of the variables 'vars' (an SCC) by nested value iteration, starting with the
+#   outermost rank, where the variables of every inner rank are solved again after every update of an outer rank
+# every inner rank is solved INNER_PRECISION times more precisely than the rank around it, otherwise its error moves the
+#   values of the outer rank by about the precision in every update, such that the outer rank may never converge
+def nestedIteration(rhs, vars, ranks, isMu, values, precision, maxIter):
+    levels = sorted(set(ranks.tolist()))
+
+    def iterate(level, levelPrecision):
+        global iterations
+        levelVars = vars[ranks == levels[level]]
+        values[levelVars] = np.where(isMu[ranks == levels[level]], 0.0, 1.0)
+        i = 0
+        residual = 1.0
+        while residual >= levelPrecision and (maxIter is None or i < maxIter):
+            if level + 1 < len(levels):
+                iterate(level + 1, max(levelPrecision * INNER_PRECISION, MIN_PRECISION))
+            newValues = rhs.evaluate(values)[ranks == levels[level]]
+            residual = np.max(np.abs(newValues - values[levelVars]))
+            values[levelVars] = newValues
+            i += 1
+        iterations += i
+
+    iterate(0, precision)
+
+
+# solves a RES in normal form numerically, one SCC of the dependency graph at a time in reverse topological order
+#   every SCC is solved by value iteration from below (starting at 0) and from above (starting at 1) at the same time
+#   since every monotone system has its solution between its least and greatest fixpoint, these give certified bounds
+#   for SCCs of a single sign the solution is usually the bound of that sign, others are solved by nested value iteration
+# depChildren gives per variable the variables it depends on, rank(var) the alternation rank of its fixpoint
+# returns the (approximate) value of the initial variable with a lower and upper bound
+def solveRES(res, depChildren, rank, precision=EPSILON, maxIter=MAXITER):
+    global iterations, sccs
+    iterations = 0
+    sccs = 0
+    lower = np.zeros(res.numvars)
+    upper = np.ones(res.numvars)
+    values = np.zeros(res.numvars)
+
+    # tarjan's algorithm gives the SCC's in reverse topological order, so all dependencies of an SCC are solved before it
+    for SCC in tarjan({eq.lhs: depChildren[eq.lhs] for eq in res.equations}):
+        equations = [res.indexedEquations[var] for var in SCC]
+        rhs = CompiledRHS(equations)
+        vars = np.array(SCC)
+        if len(SCC) == 1 and SCC[0] not in depChildren[SCC[0]]:
+            lower[vars] = rhs.evaluate(lower)
+            upper[vars] = rhs.evaluate(upper)
+            values[vars] = rhs.evaluate(values)
+            continue
+
+        sccs += 1
+        lower[vars] = 0.0
+        upper[vars] = 1.0
+        i = 0
+        while maxIter is None or i < maxIter:
+            newLower = rhs.evaluate(lower)
+            newUpper = rhs.evaluate(upper)
+            change = max(np.max(np.abs(newLower - lower[vars])), np.max(np.abs(newUpper - upper[vars])))
+            lower[vars] = newLower
+            upper[vars] = newUpper
+            i += 1
+            if np.max(upper[vars] - lower[vars]) < precision or change < precision:
+                break
+        iterations += i
+
+        # the bound of the sign of an SCC of a single sign is its solution if the variables it depends on have the same
+        #   bound as value, otherwise the solution is found by nested value iteration on the values
+        isMu = np.array([eq.sign == "mu" for eq in equations])
+        outside = rhs.entryTarget[~np.isin(rhs.entryTarget, vars)]
+        if isMu.all() and np.all(np.abs(lower[outside] - values[outside]) < precision):
+            values[vars] = lower[vars]
+        elif not isMu.any() and np.all(np.abs(upper[outside] - values[outside]) < precision):
+            values[vars] = upper[vars]
+        else:
+            nestedIteration(rhs, vars, np.array([rank(var) for var in SCC]), isMu, values, precision, maxIter)
+            values[vars] = np.clip(values[vars], lower[vars], upper[vars])
+        if printInfo:
+            print("SCC of " + str(len(SCC)) + " variables: " + str(i) + " iterations, bounds ["
+                  + str(np.min(lower[vars])) + ", " + str(np.max(upper[vars])) + "], largest gap "
+                  + str(np.max(upper[vars] - lower[vars])))
+
+    return float(values[res.initVar]), float(lower[res.initVar]), float(upper[res.initVar])
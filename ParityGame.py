@@ -0,0 +1,142 @@
+from array import array
+from TSReader import BUFFERSIZE
+
+# the owners of the nodes of a parity game, player EVEN is the player that wants to show that a formula holds
+EVEN = 0
+ODD = 1
+NATURE = 2
+ownerNames = ["EVEN", "ODD", "NATURE"]
+
+
+# a parity game with nodes 0 to numnodes - 1 stored in flat arrays
+#   owners (a bytearray) gives per node EVEN, ODD or NATURE and ranks its rank
+#   the successors of node n are succ[succStart[n]:succStart[n + 1]], where probs gives the probability of every
+#   successor of a NATURE node at the same position (and 1.0 for the successors of other nodes)
+#   states and formulas give per node the state (the variable for a game created from a RES) and the formula it was
+#   created for, which are only used for printing
+class ParityGame:
+    def __init__(self, initNode, owners, ranks, succStart, succ, probs, states, formulas):
+        self.initNode = initNode
+        self.owners = owners
+        self.ranks = ranks
+        self.succStart = succStart
+        self.succ = succ
+        self.probs = probs
+        self.states = states
+        self.formulas = formulas
+        self.numnodes = len(owners)
+
+    def successors(self, node):
+        return self.succ[self.succStart[node]:self.succStart[node + 1]]
+
+    def probabilities(self, node):
+        return self.probs[self.succStart[node]:self.succStart[node + 1]]
+
+    def nodeString(self, node):
+        if self.owners[node] == NATURE:
+            succs = str([{succ: p} for succ, p in zip(self.successors(node), self.probabilities(node))])
+        else:
+            succs = str(self.successors(node).tolist())
+        return str(node) + ":" + ownerNames[self.owners[node]] \
+            + (":" + str(self.ranks[node]) if self.owners[node] != NATURE else "") + ":" + succs \
+            + ":(" + str(self.states[node]) + ", " + ("" if self.formulas[node] is None else str(self.formulas[node])) + ")"
+
+    def __str__(self):
+        return "INIT:" + str(self.initNode) + "\n" + "\n".join([self.nodeString(node) for node in range(self.numnodes)])
+
+    # gives the largest rank rounded up to an even rank, ranks are written to .gm files as top - rank, see toGM
+    def topRank(self):
+        top = max(self.ranks, default=0)
+        return top + top % 2
+
+    # writes the game to fileName as a Graphviz graph, line by line
+    def toDot(self, fileName, addNodeLabel=True):
+        f = open(fileName, 'w', buffering=BUFFERSIZE)
+        f.write("digraph parityGame {\n")
+        for node in range(self.numnodes):
+            if self.owners[node] == NATURE:
+                f.write("n" + str(node) + "[shape=ellipse " + (",style=bold" if node == self.initNode else "") + "]\n")
+            else:
+                f.write("n" + str(node) + "[shape=" + ("box" if self.owners[node] == ODD else "diamond")
+                        + ", label=\"" + str(self.ranks[node])
+                        + ("\\n" + str(self.states[node]) + "\\n" + str(self.formulas[node]) if addNodeLabel else "")
+                        + "\"" + (",style=bold" if node == self.initNode else "") + "]\n")
+        for node in range(self.numnodes):
+            for succ, p in zip(self.successors(node), self.probabilities(node)):
+                f.write("n" + str(node) + " -> n" + str(succ)
+                        + ("[label=" + str(p) + "]" if self.owners[node] == NATURE else "") + "\n")
+        f.write("}")
+        f.close()
+
+    # writes the game to fileName in the PGSolver format (also read by Oink), line by line:
+    #   parity <largest node>;
+    #   start <initial node>;
+    #   <node> <priority> <owner> <successor>,<successor>,... ["<label>"];
+    # the owner is 0 for EVEN and 1 for ODD, and since these tools let the largest priority that occurs infinitely often
+    #   decide the winner, rank r is written as priority topRank() - r, which keeps its parity
+    # extension for games with NATURE nodes: their owner is 2 and every successor is followed by its probability, as in
+    #   5 2 2 3:0.25,4:0.75;
+    #   such files can only be read by tools that know this extension, games without NATURE nodes give standard files
+    def toGM(self, fileName, addNodeLabel=False):
+        top = self.topRank()
+        f = open(fileName, 'w', buffering=BUFFERSIZE)
+        f.write("parity " + str(self.numnodes - 1) + ";\n")
+        f.write("start " + str(self.initNode) + ";\n")
+        for node in range(self.numnodes):
+            if self.owners[node] == NATURE:
+                succs = ",".join([str(succ) + ":" + repr(p) for succ, p in zip(self.successors(node), self.probabilities(node))])
+            else:
+                succs = ",".join(map(str, self.successors(node)))
+            label = " \"" + (str(self.states[node]) + " " + str(self.formulas[node])).replace("\"", "'") + "\"" \
+                if addNodeLabel else ""
+            f.write(str(node) + " " + str(top - self.ranks[node]) + " " + str(self.owners[node]) + " " + succs + label + ";\n")
+        f.close()
+
+
+# collects the nodes of a parity game while it is created and turns them into a ParityGame
+#   nodeIds gives the node of every key, such as a (state, subformula id) pair, so that every node is created once
+class ParityGameBuilder:
+    def __init__(self):
+        self.owners = bytearray()
+        self.ranks = array('i')
+        self.successors = []
+        self.probabilities = []
+        self.states = []
+        self.formulas = []
+        self.nodeIds = {}
+
+    # returns the new node, which is stored under key unless key is None
+    def addNode(self, key, owner, rank, state=None, formula=None):
+        node = len(self.owners)
+        self.owners.append(owner)
+        self.ranks.append(rank)
+        self.successors.append([])
+        self.probabilities.append([])
+        self.states.append(state)
+        self.formulas.append(formula)
+        if key is not None:
+            self.nodeIds[key] = node
+        return node
+
+    # adds an edge, where p is only used if node is a NATURE node
+    def addSuccessor(self, node, succ, p=1.0):
+        self.successors[node].append(succ)
+        self.probabilities[node].append(p)
+
+    # gives the game with initial node initNode, where the probabilities of equal successors of NATURE nodes are added
+    def toGame(self, initNode):
+        succStart = array('i', [0])
+        succ = array('i')
+        probs = array('d')
+        for node in range(len(self.owners)):
+            if self.owners[node] == NATURE:
+                merged = {}
+                for s, p in zip(self.successors[node], self.probabilities[node]):
+                    merged[s] = merged.get(s, 0.0) + p
+                succ.extend(merged.keys())
+                probs.extend(merged.values())
+            else:
+                succ.extend(self.successors[node])
+                probs.extend([1.0] * len(self.successors[node]))
+            succStart.append(len(succ))
+        return ParityGame(initNode, self.owners, self.ranks, succStart, succ, probs, self.states, self.formulas)
@@ -7,73 +7,20 @@
 
 
 import os
+import time
+from array import array
 from FormulaReader import *
 from RealFormula import *
+import RESSolver
 from RESSolver import toDisConjunctiveForm, createRES
+from ParityGame import *
+import ParityGamePreprocessor
+import ParityGameSolver
 
 model = None
 printInfo = False
 
 
-class ParityGameNode:
-    def __init__(self, owner, rank, successors=None):
-        self.nid = None
-        self.owner = owner  # EVEN, ODD or NATURE
-        self.rank = rank
-        if successors:
-            self.successors = successors  # if owner is EVEN or ODD this is a list of nodes, else a dict of nodes:prob
-        else:
-            self.successors = []
-        self.reductionStarted = False
-        self.reduction = self
-        self.state = None  # in case created from res, this contains the variable
-        self.formula = ""
-
-    def __str__(self):
-        return str(self.nid) + ":" + self.owner + (":" + str(self.rank) if self.owner != "NATURE" else "") + ":"\
-               + (str([{n.nid: p} for n, p in self.successors.items()]) if self.owner == "NATURE" else str([n.nid for n in self.successors])) \
-               + ":(" + str(self.state) + ", " + self.formula + ")"
-
-
-class ParityGame:
-    def __init__(self, initNode, nodes, giveIds=True):
-        self.initNode = initNode
-        self.nodes = nodes
-
-        # add ids
-        if giveIds:
-            nid = 0
-            for node in nodes:
-                node.nid = nid
-                nid += 1
-
-    def __str__(self):
-        return "INIT:" + str(self.initNode.nid) + "\n" + "\n".join([str(node) for node in self.nodes])
-
-    def toDot(self, formulaName, suffix="", addNodeLabel=True):
-        out = "digraph parityGame {\n"
-        for node in self.nodes:
-            if node.owner == "NATURE":
-                out += "n" + str(node.nid) + "[shape=ellipse " + (",style=bold" if node is self.initNode else "") + "]\n"
-            else:
-                out += "n" + str(node.nid) + "[shape=" + ("box" if node.owner == "ODD" else "diamond") \
-                       + ", label=\"" + str(node.rank) + ("\\n" + str(node.state) + "\\n" + node.formula if addNodeLabel else "") + "\"" \
-                       + (",style=bold" if node is self.initNode else "") + "]\n"
-        for node in self.nodes:
-            if node.owner == "NATURE":
-                for succ, p in node.successors.items():
-                    out += "n" + str(node.nid) + " -> n" + str(succ.nid) + "[label=" + str(p) + "]\n"
-            else:
-                for succ in node.successors:
-                    out += "n" + str(node.nid) + " -> n" + str(succ.nid) + "\n"
-        out += "}"
-        f = open(os.path.sep.join([os.path.split(model.file)[0], "pg_" +
-                                   os.path.basename(os.path.splitext(model.file)[0])
-                                   + "_" + formulaName + suffix + ".dot"]), 'w')
-        f.write(out)
-        f.close()
-
-
 def nextRank(rank, becomesEven):
     if (rank % 2 == 0) == becomesEven:
         return rank
@@ -81,259 +28,353 @@ def nextRank(rank, becomesEven):
         return rank + 1
 
 
-# player nodes are indexed bij state, str(formula)
-playerNodes = {}
-natureNodes = []
+# the game being created, of which the player nodes are stored under (state, subformula id) keys
+game = None
+# the id of every subformula of the formula being converted, where equal subformulas get the same id
+subformulaIds = {}
 fixpointFormulas = {}
-
-
-def createParityGameNodes(state, formula, rank, isProbabilistic):
-    global playerNodes, natureNodes
-    fid = str(formula)
+# the rank of the fixpoint of every variable, see getFixpointRanks
+fixpointRanks = {}
+# the formulas of the 0.0 and 1.0 nodes that are created for values between them
+ZERO = lambdaFormula(0.0)
+ONE = lambdaFormula(1.0)
+
+
+# gives the rank of every fixpoint variable in formula: the rank of the fixpoint it is nested in, increased to the
+#   next even (nu) or odd (mu) rank, such that a node does not get a different rank depending on the path to it
+def getFixpointRanks(formula):
+    ranks = {}
+    stack = [(formula, 0)]
+    while stack:
+        subf, rank = stack.pop()
+        if subf.op.type in ["LEASTFP", "GREATESTFP"]:
+            rank = nextRank(rank, subf.op.type == "GREATESTFP")
+            ranks[subf.op.var] = rank
+        stack += [(child, rank) for child in subf.subformulas]
+    return ranks
+
+
+# gives an id to every subformula of formula (and to ZERO and ONE), such that equal subformulas get the same id
+# subformulas are numbered after their subformulas (reversed prefix order), so a subformula is identified by its
+#   operator and the ids of its subformulas
+def getSubformulaIds(formula):
+    ids = {}
+    structureIds = {}
+    for subf in [ZERO, ONE] + list(reversed(list(formula.iterSubFormulas()))):
+        structure = (repr(subf.op), tuple(ids[child] for child in subf.subformulas))
+        ids[subf] = structureIds.setdefault(structure, len(structureIds))
+    return ids
+
+
+# returns the node of state and formula, where rank is the rank of the fixpoint formula is in
+# a node that does not exist yet is created with its owner and rank and put on stack, so that its successors are
+#   created later by createParityGameNodes
+def getParityGameNode(state, formula, rank, stack):
+    key = (state, subformulaIds[formula])
     # check if we already have this node
-    if fid not in playerNodes[state]:
+    node = game.nodeIds.get(key)
+    if node is None:
         if formula.op.type == "VAL":
             val = formula.op.val
             # 0.0 nodes are for ODD, 1.0 nodes for EVEN (not that it matters, but it is a node they will certainly win)
             if val == 0.0:
-                playerNodes[state][fid] = ParityGameNode("ODD", nextRank(rank, False))
-                playerNodes[state][fid].successors = [playerNodes[state][fid]]
+                node = game.addNode(key, ODD, nextRank(rank, False), state, formula)
             elif val == 1.0:
-                playerNodes[state][fid] = ParityGameNode("EVEN", nextRank(rank, True))
-                playerNodes[state][fid].successors = [playerNodes[state][fid]]
+                node = game.addNode(key, EVEN, nextRank(rank, True), state, formula)
+            else:
+                node = game.addNode(key, NATURE, rank, state, formula)
+        elif formula.op.type in ["VAR", "OR"]:
+            node = game.addNode(key, EVEN, rank, state, formula)
+        elif formula.op.type == "AND":
+            node = game.addNode(key, ODD, rank, state, formula)
+        elif formula.op.type in ["DIAMOND", "BOX"]:
+            if not model.outgoing(state, formula.op.action):
+                # owner inversed for consistency with 0.0 nodes and 1.0 nodes
+                owner = EVEN if formula.op.type == "BOX" else ODD
+                node = game.addNode(key, owner, nextRank(rank, formula.op.type == "BOX"), state, formula)
+            else:
+                node = game.addNode(key, EVEN if formula.op.type == "DIAMOND" else ODD, rank, state, formula)
+        elif formula.op.type in ["LEASTFP", "GREATESTFP"]:
+            rank = fixpointRanks[formula.op.var]
+            node = game.addNode(key, EVEN, rank, state, formula)
+        stack += [(node, state, formula, rank)]
+    return node
+
+
+# creates the successors of the nodes on stack, and of the nodes created for them, until the stack is empty
+# nodes are stored before their successors are created, so that a path back to a node finds the node itself
+def createParityGameNodes(stack, isProbabilistic):
+    while stack:
+        node, state, formula, rank = stack.pop()
+        if formula.op.type == "VAL":
+            val = formula.op.val
+            if val in [0.0, 1.0]:
+                game.addSuccessor(node, node)
             else:
-                nNode = ParityGameNode("NATURE", rank)
-                succ1 = createParityGameNodes(state, lambdaFormula(0.0), rank, isProbabilistic)
-                succ2 = createParityGameNodes(state, lambdaFormula(1.0), rank, isProbabilistic)
-                nNode.successors = {succ1: 1 - val, succ2: val}
-                natureNodes += [nNode]
+                game.addSuccessor(node, getParityGameNode(state, ZERO, rank, stack), 1 - val)
+                game.addSuccessor(node, getParityGameNode(state, ONE, rank, stack), val)
         elif formula.op.type == "VAR":
-            fixf = fixpointFormulas[formula.op.var]
-            playerNodes[state][fid] = ParityGameNode("EVEN", rank, [createParityGameNodes(state, fixf, rank, isProbabilistic)])
+            game.addSuccessor(node, getParityGameNode(state, fixpointFormulas[formula.op.var], rank, stack))
         elif formula.op.type in ["AND", "OR"]:
-            successors = []
             for subf in formula.subformulas:
-                successors += [createParityGameNodes(state, subf, rank, isProbabilistic)]
-            owner = "ODD" if formula.op.type == "AND" else "EVEN"
-            playerNodes[state][fid] = ParityGameNode(owner, rank, successors)
+                game.addSuccessor(node, getParityGameNode(state, subf, rank, stack))
         elif formula.op.type in ["DIAMOND", "BOX"]:
             subf = formula.subformulas[0]
-            successors = []
-            nsuccessors = {}
             transitions = model.outgoing(state, formula.op.action)
             if not transitions:
-                # owner inversed for consistency with 0.0 nodes and 1.0 nodes
-                owner = "EVEN" if formula.op.type == "BOX" else "ODD"
-                playerNodes[state][fid] = ParityGameNode(owner, nextRank(rank, formula.op.type == "BOX"))
-                playerNodes[state][fid].successors = [playerNodes[state][fid]]
-            else:
-                owner = "EVEN" if formula.op.type == "DIAMOND" else "ODD"
-                for transition in transitions:
-                    for s in transition.enddist:
-                        succ = createParityGameNodes(s, subf, rank, isProbabilistic)
-                        if isProbabilistic:
-                            nsuccessors[succ] = transition.enddist[s]
-                        else:
-                            successors += [succ]
-
+                game.addSuccessor(node, node)
+            for transition in transitions:
+                if isProbabilistic:
+                    nNode = game.addNode(None, NATURE, rank)
+                    game.addSuccessor(node, nNode)
+                for s, p in zip(transition.targets, transition.probs):
+                    succ = getParityGameNode(s, subf, rank, stack)
                     if isProbabilistic:
-                        nNode = ParityGameNode("NATURE", rank, nsuccessors)
-                        nsuccessors = {}
-                        natureNodes += [nNode]
-                        successors += [nNode]
-
-                playerNodes[state][fid] = ParityGameNode(owner, rank, successors)
+                        game.addSuccessor(nNode, succ, p)
+                    else:
+                        game.addSuccessor(node, succ)
         elif formula.op.type in ["LEASTFP", "GREATESTFP"]:
-            subf = formula.subformulas[0]
-            nRank = nextRank(rank, formula.op.type == "GREATESTFP")
-            # store node first to avoid infinite recursion
-            playerNodes[state][fid] = ParityGameNode("EVEN", nRank)
-            playerNodes[state][fid].successors = [createParityGameNodes(state, subf, nRank, isProbabilistic)]
-    return playerNodes[state][fid]
+            game.addSuccessor(node, getParityGameNode(state, formula.subformulas[0], rank, stack))
 
 
 def createParityGameFromPLmu(formula, isProbabilistic=False):
-    global playerNodes, fixpointFormulas
-    playerNodes = [{} for i in range(model.numstates)]
+    global game, subformulaIds, fixpointFormulas, fixpointRanks
+    game = ParityGameBuilder()
+    subformulaIds = getSubformulaIds(formula)
     fixpointFormulas = {subf.op.var: subf for subf in formula.getSubFormulas(["LEASTFP", "GREATESTFP"])}
+    fixpointRanks = getFixpointRanks(formula)
 
-    initNode = createParityGameNodes(model.initstate, formula, 0, isProbabilistic)
-    pNodes = []
-    # set node data
-    for s in range(len(playerNodes)):
-        for f in playerNodes[s]:
-            node = playerNodes[s][f]
-            node.state = s
-            node.formula = f
-            pNodes += [node]
-    return ParityGame(initNode, pNodes + natureNodes)
+    stack = []
+    initNode = getParityGameNode(model.initstate, formula, 0, stack)
+    createParityGameNodes(stack, isProbabilistic)
+    return game.toGame(initNode)
 
 
-# nodes are indexed by variable, (real) formula
+# the equation of every variable of the RES a game is created from, whose nodes are stored under (variable, real
+#   formula) keys: real formulas are shared (see RealFormula.makeNode), so they identify a node by themselves
 equations = {}
-nodesFRF = {}
 
 
-# returns the node it has created
-def createParityGameNodesFromRealFormula(var, formula, rank):
-    global nodesFRF
-    fid = str(formula)
+# gives the rank of the fixpoint of the equation of var, see getFixpointRanks
+# the fixpoint that createRES puts around a formula that does not start with one is not in fixpointRanks
+def equationRank(var):
+    fixpoint = RESSolver.fixpointVars[RESSolver.fixpointOf(var)]
+    return fixpointRanks.get(fixpoint, nextRank(0, equations[var].sign == "nu"))
+
+
+# returns the node of var and formula (a subformula of the equation of var), where rank is the rank of the equation
+# a node that does not exist yet is created with its owner and rank and put on stack, so that its successors are
+#   created later by createParityGameNodesFromRealFormula
+def getParityGameNodeFromRealFormula(var, formula, rank, stack):
+    key = (var, formula)
     # check if we already have this node
-    if var not in nodesFRF:
-        nodesFRF[var] = {}
-    if fid not in nodesFRF[var]:
+    node = game.nodeIds.get(key)
+    if node is None:
         if formula.op.type == "VAL":
             val = formula.op.val
             # 0.0 nodes are for ODD, 1.0 nodes for EVEN (not that it matters, but it is a node they will certainly win)
             if val == 0.0:
-                node = ParityGameNode("ODD", nextRank(rank, False))
-                node.successors = [node]
+                node = game.addNode(key, ODD, nextRank(rank, False), var, formula)
             elif val == 1.0:
-                node = ParityGameNode("EVEN", nextRank(rank, True))
-                node.successors = [node]
+                node = game.addNode(key, EVEN, nextRank(rank, True), var, formula)
+            else:
+                node = game.addNode(key, NATURE, rank, var, formula)
+        elif formula.op.type in ["VAR", "MAXIMUM"]:
+            node = game.addNode(key, EVEN, rank, var, formula)
+        elif formula.op.type == "MINIMUM":
+            node = game.addNode(key, ODD, rank, var, formula)
+        elif formula.op.type == "LINEAR":
+            node = game.addNode(key, NATURE, rank, var, formula)
+        stack += [(node, var, formula, rank)]
+    return node
+
+
+# creates the successors of the nodes on stack, and of the nodes created for them, until the stack is empty
+def createParityGameNodesFromRealFormula(stack):
+    while stack:
+        node, var, formula, rank = stack.pop()
+        if formula.op.type == "VAL":
+            val = formula.op.val
+            if val in [0.0, 1.0]:
+                game.addSuccessor(node, node)
             else:
-                node = ParityGameNode("NATURE", rank)
-                succ1 = createParityGameNodesFromRealFormula(var, valueFormula(0.0), rank)
-                succ2 = createParityGameNodesFromRealFormula(var, valueFormula(1.0), rank)
-                node.successors = {succ1: 1 - val, succ2: val}
-            nodesFRF[var][fid] = node
+                game.addSuccessor(node, getParityGameNodeFromRealFormula(var, valueFormula(0.0), rank, stack), 1 - val)
+                game.addSuccessor(node, getParityGameNodeFromRealFormula(var, valueFormula(1.0), rank, stack), val)
         elif formula.op.type == "VAR":
             newVar = formula.op.var
-            nodesFRF[var][fid] = ParityGameNode("EVEN", rank)
-            nodesFRF[var][fid].successors = [createParityGameNodesFromRealFormula(newVar, equations[newVar].rhs,
-                                                                                  nextRank(rank, equations[newVar].sign == "nu"))]
-        elif formula.op.type == "MULTIPLY":
-            nodesFRF[var][fid] = ParityGameNode("NATURE", rank)
-            multVar = [term.op.var for term in formula.operands if term.op.type == "VAR"][0].op.var
-            multVal = [term.op.val for term in formula.operands if term.op.type == "VAL"][0].op.val
-            nodesFRF[var][fid].successors = {createParityGameNodesFromRealFormula(var, valueFormula(0.0), rank): multVal,
-                                             createParityGameNodesFromRealFormula(var, multVar, rank): 1-multVal}
-        elif formula.op.type == "ADD":
-            prob = 1
-            successors = {}
-            nodesFRF[var][fid] = ParityGameNode("NATURE", rank)
-            for operand in formula.operands:
-                if operand.op.type == "VAL":
-                    successors[createParityGameNodesFromRealFormula(var, valueFormula(1.0), rank)] = operand.op.val
-                    prob -= operand.op.val
-                elif operand.op.type == "MULTIPLY":
-                    multVarOperand = [term for term in operand.operands if term.op.type == "VAR"][0]
-                    multVal = [term.op.val for term in operand.operands if term.op.type == "VAL"][0]
-                    successors[createParityGameNodesFromRealFormula(var, multVarOperand, rank)] = multVal
-                    prob -= multVal
+            game.addSuccessor(node, getParityGameNodeFromRealFormula(newVar, equations[newVar].rhs, equationRank(newVar),
+                                                                     stack))
+        elif formula.op.type == "LINEAR":
+            term = formula.op.term
+            prob = 1 - term.constant
+            if term.constant > 0.0:
+                game.addSuccessor(node, getParityGameNodeFromRealFormula(var, valueFormula(1.0), rank, stack),
+                                  term.constant)
+            for termVar, scalar in term.coefficients.items():
+                game.addSuccessor(node, getParityGameNodeFromRealFormula(var, variableFormula(termVar), rank, stack),
+                                  scalar)
+                prob -= scalar
             if prob > 0.0:  # since we do not allow TCOSUM and TSUM, prob cannot get below 0.0
-                successors[createParityGameNodesFromRealFormula(var, valueFormula(0.0), rank)] = prob
-            nodesFRF[var][fid].successors = successors
+                game.addSuccessor(node, getParityGameNodeFromRealFormula(var, valueFormula(0.0), rank, stack), prob)
         elif formula.op.type in ["MAXIMUM", "MINIMUM"]:
-            nodesFRF[var][fid] = ParityGameNode("EVEN" if formula.op.type == "MAXIMUM" else "ODD", rank)
-            nodesFRF[var][fid].successors = [createParityGameNodesFromRealFormula(var, operand, rank) for operand in formula.operands]
-        nodesFRF[var][fid].state = var
-        nodesFRF[var][fid].formula = fid
-    return nodesFRF[var][fid]
+            for operand in formula.operands:
+                game.addSuccessor(node, getParityGameNodeFromRealFormula(var, operand, rank, stack))
 
 
 # create a parity game form a RES
 # equations that are not needed for the solution are not converted (would be unreachable anyway)
 def createParityGameFromRES(formula):
-    res = createRES(formula, model)
+    clearNodes()
+    res = createRES(formula, model, False)
     res = toDisConjunctiveForm(res)
-    global equations
+    global game, equations, fixpointRanks
+    game = ParityGameBuilder()
+    equations = {}
+    fixpointRanks = getFixpointRanks(formula)
     for equation in res.equations:
         equations[equation.lhs] = equation
 
-    initEq = res.equations[model.initstate]
-    initNode = createParityGameNodesFromRealFormula(initEq.lhs, initEq.rhs, nextRank(0, initEq.sign == "nu"))
-    return ParityGame(initNode, [nodesFRF[v][f] for v in nodesFRF for f in nodesFRF[v]])
+    initEq = equations[res.initVar]
+    stack = []
+    initNode = getParityGameNodeFromRealFormula(initEq.lhs, initEq.rhs, equationRank(initEq.lhs), stack)
+    createParityGameNodesFromRealFormula(stack)
+    return game.toGame(initNode)
+
+
+# the game being reduced: per node the node it reduces to (itself if it is not reduced), whether its reduction has
+#   started and its successors, from which reduceNode removes the successors that will never be picked
+reduction = array('i')
+reductionStarted = bytearray()
+reducedSuccessors = []
+
+
+# returns whether node is a livelock, a node of which the only successor is the node itself
+def isLivelock(parityGame, node):
+    return parityGame.owners[node] != NATURE and reducedSuccessors[node] == [node]
+
+
+# returns the node that node reduces to
+def reductionOf(node):
+    red = reduction[node]
+    # search iteratively to find what the node will reduce to
+    while red != reduction[red]:
+        red = reduction[red]
+    # let the nodes on the way reduce to red directly, so long chains of reduced nodes are followed only once
+    while reduction[node] != red:
+        reduction[node], node = red, reduction[node]
+    return red
+
+
+# marks node, which has succ as only successor, to be reduced to what succ reduces to if that does not change the
+#   smallest rank that occurs infinitely often: the reduction of succ is a livelock or has a rank of at most that of node
+def reduceToSuccessor(parityGame, node, succ):
+    red = reductionOf(succ)
+    if red != node and (isLivelock(parityGame, red) or parityGame.ranks[red] <= parityGame.ranks[node]):
+        reduction[node] = red
 
 
 # if node can be removed, it will mark node with the node to reduce to
 # also removes successors that will never be picked
-def reduceParityGameRec(node):
-    if not node.reductionStarted:
-        node.reductionStarted = True
-        if node.owner == "NATURE":
-            for succ in node.successors:
-                reduceParityGameRec(succ)
-
-            # if it only has one successor, we set this to be removed
-            if len(node.successors) == 1:
-                node.reduction = node.successors.keys()[0].reduction
+# must be called after the reduction of all successors of node that are not on a cycle with it (see reduceNodes)
+def reduceNode(parityGame, node):
+    owner = parityGame.owners[node]
+    if owner != NATURE:
+        # now the actual reductions
+        # remove successors that will certainly never be chosen
+        newSuccessors = []
+        for succ in reducedSuccessors[node]:
+            red = reductionOf(succ)
+            # remove if current node is even and the successor reduction (red) is a livelock with odd rank
+            #   (or current is odd, livelock has even rank)
+            if not (isLivelock(parityGame, red) and parityGame.ranks[red] % 2 != owner):
+                newSuccessors += [succ]
+        if not newSuccessors:
+            newSuccessors += [reducedSuccessors[node][0]]
+        reducedSuccessors[node] = newSuccessors
+
+    # if it only has one successor, we set this node to be removed
+    if len(reducedSuccessors[node]) == 1:
+        reduceToSuccessor(parityGame, node, reducedSuccessors[node][0])
+
+
+# reduces the nodes reachable from node in depth-first postorder, so every node is reduced after its successors
+#   (except the successors that are still on the stack, which are on a cycle with it)
+# the stack holds per node the index of the next successor to visit, reductionStarted marks the visited nodes
+def reduceNodes(parityGame, node):
+    reductionStarted[node] = True
+    stack = [(node, 0)]
+    while stack:
+        node, i = stack[-1]
+        if i < len(reducedSuccessors[node]):
+            stack[-1] = (node, i + 1)
+            succ = reducedSuccessors[node][i]
+            if not reductionStarted[succ]:
+                reductionStarted[succ] = True
+                stack += [(succ, 0)]
         else:
-            for succ in node.successors:
-                reduceParityGameRec(succ)
-
-            # now the actual reductions
-            # remove successors that will certainly never be chosen
-            newSuccessors = []
-            for succ in node.successors:
-                red = succ.reduction
-                # search iteratively to find what the successor will reduce to
-                while red is not red.reduction:
-                    red = red.reduction
-                # remove if current node is even and the successor reduction (red) is a livelock with odd rank
-                #   (or current is odd, livelock has even rank)
-                if not (red.owner != "NATURE" and len(red.successors) == 1 and red.successors[0] is red
-                        and ((node.owner == "EVEN" and red.rank % 2 == 1) or (node.owner == "ODD" and red.rank % 2 == 0))):
-                    newSuccessors += [succ]
-            if not newSuccessors:
-                newSuccessors += [node.successors[0]]
-            node.successors = newSuccessors
-
-            # if it only has one successor, we set this node to be removed
-            #   change rank to minimum of both if successor is not a livelock
-            if len(newSuccessors) == 1:
-                newNode = newSuccessors[0]
-                newRed = newNode.reduction
-                if not (newRed.owner != "NATURE" and len(newRed.successors) == 1 and newRed.successors[0] is newRed):
-                    newRed.rank = min(node.rank, newRed.rank)
-                node.reduction = newRed
-
-
-reachedNodes = []
-
-
-# gathers all nodes that are reachable after reduction
-def reachabilitySet(node):
-    global reachedNodes
-    reducedNode = node.reduction
-    # continue searching when it can be further reduced
-    if reducedNode.reduction is not reducedNode:
-        return reachabilitySet(reducedNode.reduction)
-    else:
-        if reducedNode not in reachedNodes:
-            reachedNodes += [reducedNode]
-            if reducedNode.owner == "NATURE":
-                newSuccessors = {}
-                for succ, p in reducedNode.successors.items():
-                    newSuccessors[reachabilitySet(succ)] = p
-                reducedNode.successors = newSuccessors
-            else:
-                for i in range(len(reducedNode.successors)):
-                    reducedNode.successors[i] = reachabilitySet(reducedNode.successors[i])
-        return reducedNode
+            stack.pop()
+            reduceNode(parityGame, node)
 
 
+# gives the game of the nodes that are reachable after reduction, numbered in the order in which they are reached
 def reduceParityGame(parityGame):
-    global reachedNodes
-    reachedNodes = []
-    reduceParityGameRec(parityGame.initNode)
-    newInit = parityGame.initNode.reduction
-    reachabilitySet(newInit)
-    return ParityGame(newInit, reachedNodes, False)
-
-
-def initParityGameCreator(ts, formula, fromRES, store, verbose, isProbabilistic):
+    global reduction, reductionStarted, reducedSuccessors
+    reduction = array('i', range(parityGame.numnodes))
+    reductionStarted = bytearray(parityGame.numnodes)
+    reducedSuccessors = [parityGame.successors(node).tolist() for node in range(parityGame.numnodes)]
+    reduceNodes(parityGame, parityGame.initNode)
+
+    reduced = ParityGameBuilder()
+    newIds = array('i', [-1]) * parityGame.numnodes
+    reachedNodes = [reductionOf(parityGame.initNode)]
+    newIds[reachedNodes[0]] = reduced.addNode(None, parityGame.owners[reachedNodes[0]], parityGame.ranks[reachedNodes[0]],
+                                              parityGame.states[reachedNodes[0]], parityGame.formulas[reachedNodes[0]])
+    for node in reachedNodes:
+        # the successors of NATURE nodes are not changed by reduceNode, so they still match their probabilities
+        for succ, p in zip(reducedSuccessors[node], parityGame.probabilities(node)):
+            red = reductionOf(succ)
+            if newIds[red] < 0:
+                newIds[red] = reduced.addNode(None, parityGame.owners[red], parityGame.ranks[red], parityGame.states[red],
+                                              parityGame.formulas[red])
+                reachedNodes += [red]
+            reduced.addSuccessor(newIds[node], newIds[red], p)
+    return reduced.toGame(0)
+
+
+# gives the file next to the model file to store a game for the formula named formulaName in
+def gameFileName(formulaName, suffix, extension):
+    return os.path.sep.join([os.path.split(model.file)[0], "pg_" + os.path.basename(os.path.splitext(model.file)[0])
+                             + "_" + formulaName + suffix + extension])
+
+
+# creates a parity game for formula on ts, reduces it, preprocesses it with ParityGamePreprocessor and solves it with
+#   ParityGameSolver
+# returns the value of the initial node with the creation time and the solving time
+def initParityGameCreator(ts, formula, fromRES, store, verbose, isProbabilistic, precision=ParityGameSolver.EPSILON,
+                          maxIter=ParityGameSolver.MAXITER):
     global model, printInfo
     model = ts
     printInfo = verbose
+    ParityGamePreprocessor.printInfo = verbose
+    # no game is solved if the formula is not supported, so the bounds of the previous formula must not be shown
+    ParityGameSolver.bounds = None
 
-    parityGame = None
     if formula.getSubFormulas(["LABEL", "PRODUCT", "COPRODUCT", "TCOSUM", "TSUM"]):
         print("The operators label, (co)product and truncated (co)sum are not supported for creating parity games")
-    elif fromRES:
+        return None, 0, 0
+
+    createStart = time.clock()
+    if fromRES:
         parityGame = reduceParityGame(createParityGameFromRES(formula))
     else:
         parityGame = reduceParityGame(createParityGameFromPLmu(formula, isProbabilistic))
-    if store and parityGame is not None:
-            parityGame.toDot(formula.name, "_RES" if fromRES else "", False)
-    return None
+    parityGame = ParityGamePreprocessor.preprocessParityGame(parityGame)
+    createEnd = time.clock()
+    if store:
+        parityGame.toDot(gameFileName(formula.name, "_RES" if fromRES else "", ".dot"), False)
+        parityGame.toGM(gameFileName(formula.name, "_RES" if fromRES else "", ".gm"))
+
+    print("Parity game created")
+
+    value, solveTime = ParityGameSolver.initParityGameSolver(parityGame, verbose, precision, maxIter)
+    return value, createEnd - createStart, solveTime
@@ -0,0 +1,156 @@
+# preprocesses the parity games of ParityGameCreator before they are solved, every pass gives a game with the same
+#   value for the initial node (also for games with NATURE nodes):
+#   - rank compression: ranks are renumbered to 0, 1, 2, ... keeping their order and parity
+#   - winning self-loops: a node of a player with a self-loop and a rank of its parity is won by that player, as are the
+#     nodes from which it can force the play to such a node (its attractor)
+#   - SCC decomposition: every play ends up in one SCC, so ranks are compressed per SCC, nodes on no cycle get the rank
+#     of a successor and bottom SCCs with ranks of a single parity are won by that player (with their attractors)
+# nodes won by a player are replaced by one livelock of that player, and nodes that become unreachable are removed
+
+from array import array
+from tarjan import tarjan
+from ParityGame import *
+
+printInfo = False
+# the winner of a node of which it is not known who wins
+UNDECIDED = 255
+
+
+# gives per rank of the nodes in group the smallest rank of at least lowest with the same parity that keeps the order of
+#   the ranks
+def compressedRanks(ranks, group, lowest=0):
+    newRanks = {}
+    newRank = None
+    for rank in sorted(set(ranks[node] for node in group)):
+        if newRank is None:
+            newRank = lowest if lowest % 2 == rank % 2 else lowest + 1
+        elif newRank % 2 != rank % 2:
+            newRank += 1
+        newRanks[rank] = newRank
+    return newRanks
+
+
+# gives game with the ranks 'ranks'
+def withRanks(game, ranks):
+    return ParityGame(game.initNode, game.owners, ranks, game.succStart, game.succ, game.probs, game.states,
+                      game.formulas)
+
+
+def compressRanks(game):
+    newRanks = compressedRanks(game.ranks, range(game.numnodes))
+    return withRanks(game, array('i', [newRanks[rank] for rank in game.ranks]))
+
+
+# adds to the nodes with winner player the nodes from which player can force the play to them: nodes of player with
+#   such a successor and nodes of the opponent and NATURE nodes of which all successors are such nodes
+def attract(game, predecessors, winner, player):
+    # per node the number of its edges to nodes that are not won by player yet, -1 if not counted yet
+    remaining = array('i', [-1]) * game.numnodes
+    queue = [node for node in range(game.numnodes) if winner[node] == player]
+    while queue:
+        node = queue.pop()
+        for pred in predecessors[node]:
+            if winner[pred] == UNDECIDED:
+                if game.owners[pred] != player:
+                    if remaining[pred] < 0:
+                        remaining[pred] = game.succStart[pred + 1] - game.succStart[pred]
+                    remaining[pred] -= 1
+                    if remaining[pred] > 0:
+                        continue
+                winner[pred] = player
+                queue += [pred]
+
+
+# gives the game in which the nodes with a winner, and the nodes that their winners can attract, are replaced by one
+#   livelock per player: one of these nodes with a rank of the parity of the player
+# nodes of a player no longer get edges to the livelock of the opponent, as they would never choose it
+def collapseWon(game, winner):
+    predecessors = [[] for node in range(game.numnodes)]
+    for node in range(game.numnodes):
+        for succ in game.successors(node):
+            predecessors[succ] += [node]
+    for player in [EVEN, ODD]:
+        attract(game, predecessors, winner, player)
+
+    representative = [None, None]
+    for node in range(game.numnodes):
+        if winner[node] != UNDECIDED and representative[winner[node]] is None and game.ranks[node] % 2 == winner[node]:
+            representative[winner[node]] = node
+    redirect = array('i', [node if winner[node] == UNDECIDED else representative[winner[node]]
+                           for node in range(game.numnodes)])
+
+    collapsed = ParityGameBuilder()
+    newIds = array('i', [-1]) * game.numnodes
+    reachedNodes = []
+
+    def newId(node):
+        if newIds[node] < 0:
+            owner = game.owners[node] if winner[node] == UNDECIDED else winner[node]
+            newIds[node] = collapsed.addNode(None, owner, game.ranks[node], game.states[node], game.formulas[node])
+            reachedNodes.append(node)
+        return newIds[node]
+
+    newId(redirect[game.initNode])
+    for node in reachedNodes:
+        if winner[node] != UNDECIDED:
+            collapsed.addSuccessor(newIds[node], newIds[node])
+        elif game.owners[node] == NATURE:
+            for succ, p in zip(game.successors(node), game.probabilities(node)):
+                collapsed.addSuccessor(newIds[node], newId(redirect[succ]), p)
+        else:
+            # an undecided node has a successor that is not won by the opponent, otherwise it would be attracted
+            successors = dict.fromkeys(redirect[succ] for succ in game.successors(node))
+            for succ in successors:
+                if winner[succ] != 1 - game.owners[node]:
+                    collapsed.addSuccessor(newIds[node], newId(succ))
+    return collapsed.toGame(0)
+
+
+def removeWinningSelfLoops(game):
+    winner = bytearray([UNDECIDED]) * game.numnodes
+    for node in range(game.numnodes):
+        owner = game.owners[node]
+        if owner != NATURE and game.ranks[node] % 2 == owner and node in game.successors(node):
+            winner[node] = owner
+    return collapseWon(game, winner)
+
+
+def decomposeSCCs(game):
+    ranks = array('i', game.ranks)
+    # the ranks of an SCC are compressed starting at the smallest rank of the game, so that no smaller rank is added
+    lowest = min(game.ranks)
+    winner = bytearray([UNDECIDED]) * game.numnodes
+    # tarjan's algorithm gives the SCC's in reverse topological order, so the SCC's of the successors of a node come first
+    for SCC in tarjan({node: game.successors(node) for node in range(game.numnodes)}):
+        if len(SCC) == 1 and SCC[0] not in game.successors(SCC[0]):
+            # the rank of a node on no cycle does not occur infinitely often
+            ranks[SCC[0]] = ranks[game.succ[game.succStart[SCC[0]]]]
+            continue
+        newRanks = compressedRanks(game.ranks, SCC, lowest)
+        for node in SCC:
+            ranks[node] = newRanks[game.ranks[node]]
+        parities = set(rank % 2 for rank in newRanks.values())
+        inSCC = set(SCC)
+        if len(parities) == 1 and all(succ in inSCC for node in SCC for succ in game.successors(node)):
+            player = parities.pop()
+            for node in SCC:
+                winner[node] = player
+    return collapseWon(withRanks(game, ranks), winner)
+
+
+# prints how many nodes, edges and ranks the pass called name removed from game to give newGame
+def report(name, game, newGame):
+    if printInfo:
+        print("##### " + name + ": removed " + str(game.numnodes - newGame.numnodes) + " nodes, "
+              + str(len(game.succ) - len(newGame.succ)) + " edges, "
+              + str(len(set(game.ranks)) - len(set(newGame.ranks))) + " ranks")
+
+
+# applies all passes to game and returns the resulting game
+def preprocessParityGame(game):
+    for name, preprocess in [("rank compression", compressRanks), ("winning self-loops", removeWinningSelfLoops),
+                             ("SCC decomposition", decomposeSCCs)]:
+        newGame = preprocess(game)
+        report(name, game, newGame)
+        game = newGame
+    return game
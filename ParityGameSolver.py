@@ -0,0 +1,124 @@
+# solves the parity games of ParityGameCreator, in which player EVEN wins a play if the smallest rank that occurs
+#   infinitely often is even
+# games without NATURE nodes are solved by Zielonka's algorithm, which gives the nodes won by each player
+# in games with NATURE nodes, EVEN maximizes and ODD minimizes the probability that EVEN wins; this value is the
+#   nested fixpoint nu Z0.mu Z1.nu Z2... in which the nodes of rank i use Z_i (de Alfaro and Majumdar), so the game is
+#   solved as a RES with an equation per node by NumericRESSolver
+
+import time
+from RealFormula import *
+from RESSolver import RealEquation, RealEquationSystem
+import NumericRESSolver
+from ParityGame import EVEN, ODD, NATURE
+
+printInfo = False
+# value iteration for games with NATURE nodes stops when the values are known up to EPSILON (or after MAXITER
+#   iterations), see NumericRESSolver
+EPSILON = NumericRESSolver.EPSILON
+MAXITER = NumericRESSolver.MAXITER
+# the lower and upper bound of the last value of a game with NATURE nodes, None for a game without
+bounds = None
+
+# the game being solved, see ParityGame: owners gives per node EVEN or ODD, ranks its rank and successors and
+#   predecessors its edges
+owners = bytearray()
+ranks = []
+successors = []
+predecessors = []
+
+
+# gives the nodes of 'subgame' (a set) from which 'player' can force the play to a node in 'target' within subgame
+def attractor(subgame, target, player):
+    attracted = set(target)
+    # per node of the opponent, the number of its successors in subgame that are not attracted yet
+    remaining = {}
+    queue = list(attracted)
+    while queue:
+        node = queue.pop()
+        for pred in predecessors[node]:
+            if pred in subgame and pred not in attracted:
+                if owners[pred] != player:
+                    if pred not in remaining:
+                        remaining[pred] = sum(1 for succ in successors[pred] if succ in subgame)
+                    remaining[pred] -= 1
+                    if remaining[pred] > 0:
+                        continue
+                attracted.add(pred)
+                queue.append(pred)
+    return attracted
+
+
+# gives the nodes of 'subgame' won by EVEN and by ODD, subgame must be a set of nodes that all have a successor in it
+# the second recursive call of Zielonka's algorithm is done by the loop, so the recursion depth is at most the number
+#   of ranks
+def zielonka(subgame):
+    won = (set(), set())
+    while subgame:
+        rank = min(ranks[node] for node in subgame)
+        player = rank % 2
+        top = attractor(subgame, [node for node in subgame if ranks[node] == rank], player)
+        subWon = zielonka(subgame - top)
+        if not subWon[1 - player]:
+            won[player].update(subgame)
+            break
+        lost = attractor(subgame, subWon[1 - player], 1 - player)
+        won[1 - player].update(lost)
+        subgame = subgame - lost
+    return won
+
+
+# gives the RES with for node i the equation of variable i, which is the maximum (EVEN), minimum (ODD) or weighted sum
+#   (NATURE) of its successors, with sign nu for an even rank and mu for an odd rank
+def createGameRES(game):
+    equations = []
+    depChildren = []
+    for node in range(game.numnodes):
+        nodeSuccessors = game.successors(node)
+        if nodeSuccessors.tolist() == [node]:
+            # a livelock is won by the parity of its rank, so its value is fixed before iterating
+            rhs = valueFormula(1.0 if game.ranks[node] % 2 == 0 else 0.0)
+        elif game.owners[node] == NATURE:
+            rhs = linearFormula(LinearTerm(0.0, dict(zip(nodeSuccessors, game.probabilities(node)))))
+        else:
+            operands = [linearFormula(LinearTerm(0.0, {succ: 1.0})) for succ in nodeSuccessors]
+            rhs = makeNode(RealOperatorNode("MAXIMUM" if game.owners[node] == EVEN else "MINIMUM"), operands)
+        equations += [RealEquation("nu" if game.ranks[node] % 2 == 0 else "mu", node, rhs)]
+        depChildren += [set(rhs.getVariables())]
+    return RealEquationSystem(equations, game.initNode, len(equations)), depChildren
+
+
+# returns the value of the initial node of game, 1.0 or 0.0 for a game without NATURE nodes
+def solveParityGame(game, precision=EPSILON, maxIter=MAXITER):
+    global owners, ranks, successors, predecessors, bounds
+    bounds = None
+    if printInfo:
+        print("##### parity game: " + str(game.numnodes) + " nodes, " + str(len(game.succ)) + " edges, "
+              + str(len(set(game.ranks))) + " ranks")
+
+    if NATURE in game.owners:
+        res, depChildren = createGameRES(game)
+        value, lower, upper = NumericRESSolver.solveRES(res, depChildren, game.ranks.__getitem__, precision, maxIter)
+        bounds = (lower, upper)
+        return value
+
+    owners = game.owners
+    ranks = game.ranks
+    successors = [game.successors(node).tolist() for node in range(game.numnodes)]
+    predecessors = [[] for node in range(game.numnodes)]
+    for node, nodeSuccessors in enumerate(successors):
+        for succ in nodeSuccessors:
+            predecessors[succ].append(node)
+    won = zielonka(set(range(game.numnodes)))
+    if printInfo:
+        print("##### EVEN wins " + str(len(won[EVEN])) + " nodes, ODD wins " + str(len(won[ODD])) + " nodes")
+    return 1.0 if game.initNode in won[EVEN] else 0.0
+
+
+# solves game and returns its value with the solving time
+def initParityGameSolver(game, verbose, precision=EPSILON, maxIter=MAXITER):
+    global printInfo
+    printInfo = verbose
+    NumericRESSolver.printInfo = verbose
+    solveStart = time.clock()
+    value = solveParityGame(game, precision, maxIter)
+    return value, time.clock() - solveStart
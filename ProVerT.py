@@ -5,22 +5,41 @@ import plmuChecker
 import BESSolver
 import RESSolver
 import ParityGameCreator
+import ParityGameSolver
 
 
 def main():
     parser = argparse.ArgumentParser(description='check a plmu formula on a PLTS')
     parser.add_argument("-e", "--equations", help="solve via RES", action="store_true")
-    parser.add_argument("-l", "--local", help="create local RES", action="store_true")
+    parser.add_argument("-l", "--local", help="create local RES (or BES with -b)", action="store_true")
     parser.add_argument("-d", "--depGraph", help="create and use dependency graph for substitution", action="store_true")
     parser.add_argument("-o", "--order", help="solve a RES in an efficient order using SSC's, includes -l and -d", action="store_true")
-    parser.add_argument("-p", "--paritygame", help="create a paritygame (if also -e, create via RES)", action="store_true")
-    parser.add_argument("-s", "--store", help="store intermediate results such as a BES", action="store_true")
+    parser.add_argument("--engine", default="symbolic", choices=["symbolic", "numeric"], help="solve a RES by Gauss elimination (symbolic) or by value iteration per SCC (numeric), only with -e")
+    parser.add_argument("--policy", help="solve SCC's without alternation between max and min by policy iteration, only with -o", action="store_true")
+    parser.add_argument("--qualitative", help="find the variables of reachability fixpoints that are 0 or 1 by graph analysis before creating a RES, only with -e", action="store_true")
+    parser.add_argument("-b", "--boolean", help="solve via BES, only for non-probabilistic models and formulas", action="store_true")
+    parser.add_argument("-p", "--paritygame", help="create and solve a parity game (if also -e, create via RES)", action="store_true")
+    parser.add_argument("-s", "--store", help="store intermediate results such as a BES or a parity game (.dot and PGSolver .gm)", action="store_true")
     parser.add_argument("-v", "--verbose", help="display info", action="store_true")
+    parser.add_argument("--precision", default=plmuChecker.EPSILON, type=float, metavar="EPS", help="stop approximating a fixpoint when no value changes more than EPS")
+    parser.add_argument("--gauss-seidel", dest="gaussSeidel", help="approximate fixpoints with in-place (Gauss-Seidel) updates", action="store_true")
+    parser.add_argument("--interval", help="approximate fixpoints from below and above at the same time and give the bounds of the result", action="store_true")
+    parser.add_argument("--maxiter", default=plmuChecker.MAXITER, type=int, metavar="N", help="approximate a fixpoint with at most N iterations (default %(default)s)")
     parser.add_argument('-r', "--runs", default=[1], action='store', nargs=1, type=int, help='run the same problem multiple times and give the average running time')
-    parser.add_argument('model', help='the model to check a formula on (path to file)')
-    parser.add_argument('formulas', help='the formula(s) to check on a model (path to file)')
+    parser.add_argument('model', help='the model to check a formula on (path to file), or a BES stored with -s (.bes file)')
+    parser.add_argument('formulas', nargs='?', help='the formula(s) to check on a model (path to file)')
     args = parser.parse_args()
 
+    # solve a stored BES
+    if args.model.endswith(".bes"):
+        result = BESSolver.initStoredBESSolver(args.model, args.verbose)
+        if result is not None:
+            print("The result of " + result[0] + " is: " + str(float(result[1])))
+            print("Running time: " + str(result[2]) + ' seconds')
+        return
+    if args.formulas is None:
+        parser.error("the following arguments are required: formulas")
+
     model = readTS(args.model)
     formulas = readFormula(args.formulas)
     # initiate clock
@@ -33,9 +52,8 @@ def main():
                 print("The operators (co)product and truncated (co)sum are not supported when using the label operator")
             else:
                 isOnlyProbabilistic = model.isProbabilistic or formula.isOnlyProbabilistic
-                if args.paritygame:
-                    print("Creating parity game for formula " + str(formula))
-                    ParityGameCreator.initParityGameCreator(model, formula, args.equations, args.store, args.verbose, isOnlyProbabilistic)
+                if args.boolean and not args.paritygame and isOnlyProbabilistic:
+                    print("A BES can only be used for non-probabilistic models and formulas")
                 else:
                     creationTimes = []
                     solveTimes = []
@@ -43,13 +61,26 @@ def main():
                     for i in range(numberOfRuns):
                         # do the model checking
                         print("Computing result for formula " + str(formula))
-                        if args.equations:
-                            result = RESSolver.initRESSolver(model, formula, args.store, args.verbose, args.local or args.order, args.depGraph or args.order, args.order)
+                        if args.paritygame:
+                            result = ParityGameCreator.initParityGameCreator(model, formula, args.equations, args.store, args.verbose,
+                                                                             isOnlyProbabilistic, args.precision, args.maxiter)
+                            value = result[0]
+                            creationTimes += [result[1]]
+                            solveTimes += [result[2]]
+                        elif args.equations:
+                            result = RESSolver.initRESSolver(model, formula, args.store, args.verbose, args.local or args.order, args.depGraph or args.order, args.order, args.policy,
+                                                             args.engine, args.precision, args.maxiter, args.qualitative)
                             value = result[0]
                             creationTimes += [result[1]]
                             solveTimes += [result[2]]
+                        elif args.boolean:
+                            result = BESSolver.initBESSolver(model, formula, args.store, args.verbose, args.local or args.order)
+                            value = float(result[0])
+                            creationTimes += [result[1]]
+                            solveTimes += [result[2]]
                         else:
-                            result = plmuChecker.checkNaiveInit(model, formula, args.verbose)
+                            result = plmuChecker.checkVectorInit(model, formula, args.verbose, args.precision, args.gaussSeidel, args.maxiter,
+                                                                 args.interval)
                             value = result[0]
                             solveTimes += [result[1]]
 
@@ -57,13 +88,27 @@ def main():
                             print("Could not compute result for formula " + str(formula) + '\n')
                             break
 
-                        if hasLabelOperator:
+                        if hasLabelOperator and value is not None:
                             value = value * model.labelFactor
 
                     print("The result of " + str(formula) + " is: " + str(value))
-                    if args.equations:
+                    if args.paritygame:
+                        resultBounds = ParityGameSolver.bounds
+                    else:
+                        resultBounds = RESSolver.bounds if args.equations else plmuChecker.bounds
+                    if resultBounds is not None:
+                        lower, upper = resultBounds
+                        if hasLabelOperator:
+                            lower, upper = lower * model.labelFactor, upper * model.labelFactor
+                        print("Bounds: [" + str(lower) + ", " + str(upper) + "]")
+                    if args.equations or args.boolean or args.paritygame:
                         print("Creation time: " + str(sum(creationTimes) / numberOfRuns) + ' seconds')
                     print("Running time: " + str(sum(solveTimes)/numberOfRuns) + ' seconds')
+                    if not args.equations and not args.boolean and not args.paritygame:
+                        for var in sorted(plmuChecker.iterations):
+                            print("Fixpoint " + var + ": " + str(plmuChecker.iterations[var]) + " iterations, residual "
+                                  + str(plmuChecker.residuals[var])
+                                  + (", gap " + str(plmuChecker.gaps[var]) if args.interval else ""))
                     if numberOfRuns > 1:
                         print("Individual timings: " + str(solveTimes))
                     print('\n')
@@ -0,0 +1,112 @@
+import numpy as np
+from tarjan import tarjan
+
+
+# returns the concatenation of the ranges [starts[i], starts[i] + counts[i])
+def concatRanges(starts, counts):
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+# returns the operands of a flattened tree of binary operators of type opType
+def flatten(formula, opType):
+    if formula.op.type == opType:
+        return flatten(formula.subformulas[0], opType) + flatten(formula.subformulas[1], opType)
+    return [formula]
+
+
+# for a fixpoint formula of the shape mu X.(<a1>X || ... || <an>X || f1 || ... || fm) with X not in the fi,
+#   or of the dual shape nu X.([a1]X && ... && [an]X && f1 && ... && fm), returns the actions a1..an and the fi
+# returns None, None for other formulas
+def reachabilityShape(formula):
+    var = formula.op.var
+    isMu = formula.op.type == "LEASTFP"
+    operands = flatten(formula.subformulas[0], "OR" if isMu else "AND")
+    actions = [operand.op.action for operand in operands if operand.op.type == ("DIAMOND" if isMu else "BOX")
+               and operand.subformulas[0].op.type == "VAR" and operand.subformulas[0].op.var == var]
+    closed = [operand for operand in operands if var not in operand.vars]
+    if actions and len(actions) + len(closed) == len(operands):
+        return actions, closed
+    return None, None
+
+
+# gives the transitions (rows) of ts with an action in 'actions', their source states,
+#   and the entries of their distributions together with the row of every entry
+def transitionEntries(ts, actions):
+    stateStart = np.asarray(ts.stateStart)
+    distStart = np.asarray(ts.distStart)
+    aids = [ts.actionIds[action] for action in actions if action in ts.actionIds]
+    rows = np.flatnonzero(np.isin(np.asarray(ts.transAction), aids))
+    sources = np.repeat(np.arange(ts.numstates), np.diff(stateStart))[rows]
+    counts = distStart[rows + 1] - distStart[rows]
+    entries = concatRanges(distStart[rows], counts)
+    entryRow = np.repeat(np.arange(len(rows)), counts)
+    return rows, sources, entries, entryRow
+
+
+# returns the maximal end components of the transitions of ts with an action in 'actions'
+#   as an array with per state the index of its end component or -1 if it is not in one
+#   together with the transitions (rows) that start in an end component but may leave it
+# an end component is a set of states with for every state a transition that stays in the set, such that every state
+#   can reach every other state; it is found by removing transitions that leave their SCC until nothing changes
+def maximalEndComponents(ts, actions):
+    targets = np.asarray(ts.targets)
+    rows, sources, entries, entryRow = transitionEntries(ts, actions)
+    alive = np.ones(len(rows), dtype=bool)
+    while True:
+        graph = {state: set() for state in range(ts.numstates)}
+        aliveEntries = alive[entryRow]
+        for source, target in zip(sources[entryRow[aliveEntries]].tolist(), targets[entries[aliveEntries]].tolist()):
+            graph[source].add(target)
+        component = np.empty(ts.numstates, dtype=int)
+        for i, SCC in enumerate(tarjan(graph)):
+            component[SCC] = i
+        hasRow = np.zeros(ts.numstates, dtype=bool)
+        hasRow[sources[alive]] = True
+        # a transition can only stay in an end component if all its targets are in the SCC of its source
+        #   and have a transition themselves
+        leaves = (component[targets[entries]] != component[sources[entryRow]]) | ~hasRow[targets[entries]]
+        newAlive = alive & ~(np.bincount(entryRow, weights=leaves, minlength=len(rows)) > 0)
+        if np.array_equal(newAlive, alive):
+            break
+        alive = newAlive
+    mec = np.where(hasRow, component, -1)
+    _, mec[hasRow] = np.unique(component[hasRow], return_inverse=True)
+    return mec, rows[~alive & (mec[sources] >= 0)]
+
+
+# returns which states can reach a state in 'start' (a boolean array) over the edges from sources[i] to targets[i]
+def backwardReachable(start, sources, targets, numstates):
+    order = np.argsort(targets, kind="stable")
+    predecessors = sources[order].tolist()
+    predStart = np.searchsorted(targets[order], np.arange(numstates + 1)).tolist()
+    reached = start.tolist()
+    stack = np.flatnonzero(start).tolist()
+    while stack:
+        state = stack.pop()
+        for pred in predecessors[predStart[state]:predStart[state + 1]]:
+            if not reached[pred]:
+                reached[pred] = True
+                stack.append(pred)
+    return np.array(reached, dtype=bool)
+
+
+# for the least fixpoint of X = max(f, <a1>X, ..., <an>X), where value gives f per state,
+#   returns which states have value exactly 0 and which have value exactly 1, using only the graph of ts
+# a state has value 0 iff it cannot reach a state where f is positive, and value 1 iff it can reach a state where f is 1
+#   with probability 1; the latter states are the greatest set from which such a state can be reached by transitions
+#   that cannot leave the set, found by removing the states that cannot until nothing changes
+def qualitativeStates(ts, actions, value):
+    rows, sources, entries, entryRow = transitionEntries(ts, actions)
+    targets = np.asarray(ts.targets)[entries]
+    entrySources = sources[entryRow]
+    zero = ~backwardReachable(value > 0.0, entrySources, targets, ts.numstates)
+    one = np.ones(ts.numstates, dtype=bool)
+    while True:
+        leaves = np.bincount(entryRow, weights=~one[targets], minlength=len(rows)) > 0
+        stays = (~leaves & one[sources])[entryRow]
+        newOne = backwardReachable(value >= 1.0, entrySources[stays], targets[stays], ts.numstates)
+        if np.array_equal(newOne, one):
+            break
+        one = newOne
+    return zero, one
@@ -1,13 +1,21 @@
 import os
 import time
+import numpy as np
+import RealFormula
 from RealFormula import *
 from FormulaReader import *
 from tarjan import tarjan
+import NumericRESSolver
+from Qualitative import reachabilityShape, qualitativeStates
 
 # maximum number of iterations for the solver by fixpoint
 MAX_ITER = 5
+# approximation stops when the value changes less than PRECISION
+PRECISION = 1e-10
 
 
+# variables are integers: the variable of fixpoint i for state s is i * numstates + s
+# variables introduced while solving get the integers after those
 class RealEquation:
     def __init__(self, sign, lhs, rhs):
         self.sign = sign
@@ -16,17 +24,18 @@ class RealEquation:
         self.processed = False
 
     def __str__(self):
-        return self.sign + ' ' + self.lhs + ' = ' + str(self.rhs)
+        return self.sign + ' ' + varName(self.lhs) + ' = ' + str(self.rhs)
 
     def __repr__(self):
-        return self.sign + ' ' + self.lhs + ' = ' + repr(self.rhs)
+        return self.sign + ' ' + varName(self.lhs) + ' = ' + repr(self.rhs)
 
 
 class RealEquationSystem:
-    def __init__(self, equations, initVar):
+    def __init__(self, equations, initVar, numvars):
         self.equations = equations
+        self.numvars = numvars
         # we also index the equations on the variable in the left hand side for easy access
-        self.indexedEquations = {}
+        self.indexedEquations = [None] * numvars
         for eq in equations:
             self.indexedEquations[eq.lhs] = eq
 
@@ -43,27 +52,130 @@ class RealEquationSystem:
 # assumes that the res is simplified and in normal form
 def toDisConjunctiveForm(res):
     newEquations = []
+    numvars = res.numvars
     for equation in res.equations:
         f = equation.rhs
         if f.op.type == "MAXIMUM" and any([subf.op.type == "MINIMUM" for subf in f.operands]):
             nr = 0
             extraEquations = []
-            for i in range(len(f.operands)):
-                subf = f.operands[i]
+            operands = []
+            for subf in f.operands:
                 if subf.op.type == "MINIMUM":
-                    newVar = equation.lhs + "-" + str(nr)
+                    newVar = numvars
+                    numvars += 1
+                    auxNames[newVar] = varName(equation.lhs) + "-" + str(nr)
+                    auxParents[newVar] = auxParents.get(equation.lhs, equation.lhs)
                     nr += 1
                     extraEquations += [RealEquation(equation.sign, newVar, subf)]
-                    f.operands[i] = newVar
+                    operands += [variableFormula(newVar)]
+                else:
+                    operands += [subf]
+            equation.rhs = withOperands(f, operands)
             newEquations += [equation] + extraEquations
         else:
             newEquations += [equation]
 
-    return RealEquationSystem(newEquations, res.initVar)
+    return RealEquationSystem(newEquations, res.initVar, numvars)
 
 
 model = None
 printInfo = False
+# whether SCCs without alternation between max and min are solved numerically by policy iteration
+usePolicy = False
+# the lower and upper bound of the last result of the numeric engine
+bounds = None
+# whether variables of reachability-shaped fixpoints that are 0 or 1 are found by graph analysis before creating the RES
+useQualitative = False
+# the variables with a value known before creating the RES and their value
+fixedValues = {}
+# the fixpoint variables in the order of the formula and their index
+fixpointVars = []
+fixpointIndex = {}
+# names of variables introduced while creating or solving the RES
+auxNames = {}
+# the variable of the equation each introduced variable was introduced for
+auxParents = {}
+# the equations introduced for the right-hand side that is being created
+auxEquations = []
+# the sign and variable of the equation of which the right-hand side is being created
+currentEquation = None
+
+
+# gives the readable name of a variable, such as X12 for fixpoint variable X and state 12
+def varName(var):
+    if var in auxNames:
+        return auxNames[var]
+    return fixpointVars[var // model.numstates] + str(var % model.numstates)
+
+
+RealFormula.variableName = varName
+
+
+# initializes the fixpoint variables of formula, which must start with a fixpoint operator
+def indexFixpoints(fixpoints):
+    global fixpointVars, fixpointIndex, auxNames, auxParents
+    fixpointVars = [fixf.op.var for fixf in fixpoints]
+    fixpointIndex = {var: i for i, var in enumerate(fixpointVars)}
+    auxNames = {}
+    auxParents = {}
+
+
+# gives the index of the fixpoint of a variable, for an introduced variable that of the equation it was introduced for
+def fixpointOf(var):
+    return auxParents.get(var, var) // model.numstates
+
+
+# gives a new variable for a subformula of the current right-hand side that is too large to distribute over
+#   its equation has the same sign and is put directly after the current equation, see RealFormula.distribute
+def auxiliaryVariable(formula):
+    sign, var = currentEquation
+    newVar = len(fixpointVars) * model.numstates + len(auxNames)
+    auxNames[newVar] = varName(var) + "-" + str(len(auxEquations))
+    auxParents[newVar] = var
+    auxEquations.append(RealEquation(sign, newVar, simplify(formula, True)))
+    return variableFormula(newVar)
+
+
+# creates the equation of var with right-hand side rhs in normal form
+# returns it followed by the equations of the variables introduced for subformulas that were too large to distribute
+def createEquations(sign, var, rhs):
+    global currentEquation, auxEquations
+    currentEquation = (sign, var)
+    auxEquations = []
+    RealFormula.auxiliaryVariable = auxiliaryVariable
+    equation = RealEquation(sign, var, simplify(toNormalForm(simplify(rhs)), True))
+    RealFormula.auxiliaryVariable = None
+    return [equation] + auxEquations
+
+
+# for every fixpoint mu X.(<a1>X || ... || <an>X || f) with f a formula without variables (or the dual
+#   nu X.([a1]X && ... && [an]X && f)), finds the states where X is exactly 0 or 1 from the graph of the model
+#   and stores them in fixedValues, so that their equations are not created and their occurrences become values
+# only done if useQualitative
+def fixQualitativeVariables(fixpoints):
+    global fixedValues
+    fixedValues = {}
+    if not useQualitative:
+        return
+    for fixf in fixpoints:
+        actions, closed = reachabilityShape(fixf)
+        if actions is None or any(f.vars for f in closed):
+            continue
+        isMu = fixf.op.type == "LEASTFP"
+        values = np.zeros(model.numstates) if isMu else np.ones(model.numstates)
+        for state in range(model.numstates):
+            for f in closed:
+                val = simplify(toNormalForm(simplify(RHS(state, f))), True).op.val
+                values[state] = max(values[state], val) if isMu else min(values[state], val)
+        # the greatest fixpoint is the complement of the least fixpoint of the complement
+        zero, one = qualitativeStates(model, actions, values if isMu else 1.0 - values)
+        offset = fixpointIndex[fixf.op.var] * model.numstates
+        for state in np.flatnonzero(zero).tolist():
+            fixedValues[offset + state] = 0.0 if isMu else 1.0
+        for state in np.flatnonzero(one).tolist():
+            fixedValues[offset + state] = 1.0 if isMu else 0.0
+    if printInfo:
+        print("##### fixed " + str(len(fixedValues)) + " variables by graph analysis")
 
 
 # creates the right-hand side of a boolean equation
@@ -74,8 +186,10 @@ def RHS(state, formula):
 
     # in case variable or fixpoint, its just a variable
     elif formula.op.type in ["VAR", "LEASTFP", "GREATESTFP"]:
-        newVar = formula.op.var + str(state)
-        return RealFormulaNode(RealOperatorNode("VAR", newVar))
+        var = fixpointIndex[formula.op.var] * model.numstates + state
+        if var in fixedValues:
+            return valueFormula(fixedValues[var])
+        return variableFormula(var)
 
     # in case of label operator, return the label
     elif formula.op.type == "LABEL":
@@ -84,42 +198,38 @@ def RHS(state, formula):
     # in case binary (OR, AND, PRODUCT, COPRODUCT, TCOSUM, TSUM, LAMBDA), apply semantics
     elif formula.op.type == "OR":
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        return RealFormulaNode(RealOperatorNode("MAXIMUM"), operands)
+        return makeNode(RealOperatorNode("MAXIMUM"), operands)
     elif formula.op.type == "AND":
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        return RealFormulaNode(RealOperatorNode("MINIMUM"), operands)
+        return makeNode(RealOperatorNode("MINIMUM"), operands)
     elif formula.op.type == "PRODUCT":  # NOT SUPPORTED
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        return RealFormulaNode(RealOperatorNode("MULTIPLY"), operands)
+        return makeNode(RealOperatorNode("MULTIPLY"), operands)
     elif formula.op.type == "COPRODUCT":  # NOT SUPPORTED
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        addition = RealFormulaNode(RealOperatorNode("ADD"), operands)
-        multiplication = RealFormulaNode(RealOperatorNode("MULTIPLY"), operands)
-        return RealFormulaNode(RealOperatorNode("SUBTRACT"), [addition, multiplication])
+        addition = makeNode(RealOperatorNode("ADD"), operands)
+        multiplication = makeNode(RealOperatorNode("MULTIPLY"), operands)
+        return makeNode(RealOperatorNode("SUBTRACT"), [addition, multiplication])
     elif formula.op.type == "TCOSUM":
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        addition = RealFormulaNode(RealOperatorNode("ADD"), operands)
-        subtraction = RealFormulaNode(RealOperatorNode("ADD"), [addition, valueFormula(-1.0)])
-        importantZero = valueFormula(0.0)
-        importantZero.makeImportant()
-        return RealFormulaNode(RealOperatorNode("MAXIMUM"), [importantZero, subtraction])
+        addition = makeNode(RealOperatorNode("ADD"), operands)
+        subtraction = makeNode(RealOperatorNode("ADD"), [addition, valueFormula(-1.0)])
+        return makeNode(RealOperatorNode("MAXIMUM"), [valueFormula(0.0, True), subtraction])
     elif formula.op.type == "TSUM":
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        addition = RealFormulaNode(RealOperatorNode("ADD"), operands)
-        importantOne = valueFormula(1.0)
-        importantOne.makeImportant()
-        return RealFormulaNode(RealOperatorNode("MINIMUM"), [importantOne, addition])
+        addition = makeNode(RealOperatorNode("ADD"), operands)
+        return makeNode(RealOperatorNode("MINIMUM"), [valueFormula(1.0, True), addition])
     elif formula.op.type == "LAMBDA":
         operands = [RHS(state, formula.subformulas[i]) for i in [0, 1]]
-        multiplication1 = RealFormulaNode(RealOperatorNode("MULTIPLY"), [valueFormula(formula.op.val), operands[0]])
-        multiplication2 = RealFormulaNode(RealOperatorNode("MULTIPLY"), [valueFormula(1 - formula.op.val), operands[1]])
-        return RealFormulaNode(RealOperatorNode("ADD"), [multiplication1, multiplication2])
+        multiplication1 = makeNode(RealOperatorNode("MULTIPLY"), [valueFormula(formula.op.val), operands[0]])
+        multiplication2 = makeNode(RealOperatorNode("MULTIPLY"), [valueFormula(1 - formula.op.val), operands[1]])
+        return makeNode(RealOperatorNode("ADD"), [multiplication1, multiplication2])
 
     # in case diamond or box, create formula with subformula for each outgoing transition with given action
     elif formula.op.type in ["DIAMOND", "BOX"]:
-        products = [[RealFormulaNode(RealOperatorNode("MULTIPLY"), [
-            valueFormula(t.enddist[endstate]), RHS(endstate, formula.subformulas[0])
-        ]) for endstate in t.enddist.keys()
+        products = [[makeNode(RealOperatorNode("MULTIPLY"), [
+            valueFormula(p), RHS(endstate, formula.subformulas[0])
+        ]) for endstate, p in zip(t.targets, t.probs)
                      ] for t in model.outgoing(state, formula.op.action)]
 
         # in case no transitions, return 0 if diamond, else 1
@@ -131,7 +241,7 @@ def RHS(state, formula):
             if len(products[0]) == 1:
                 return products[0][0]
             else:
-                return RealFormulaNode(RealOperatorNode("ADD"), products[0])
+                return makeNode(RealOperatorNode("ADD"), products[0])
 
         # in case more than one transition, create maximum if diamond, else minimum
         else:
@@ -141,13 +251,39 @@ def RHS(state, formula):
                 if len(transProducts) == 1:
                     sums += [transProducts[0]]
                 else:
-                    sums += [RealFormulaNode(RealOperatorNode("ADD"), transProducts)]
-            return RealFormulaNode(RealOperatorNode(op), sums)
+                    sums += [makeNode(RealOperatorNode("ADD"), transProducts)]
+            return makeNode(RealOperatorNode(op), sums)
+
+
+# the dependence graph, indexed by variable
+depChildren = []  # X:set means X depends on all variables in set
+depParents = []  # X:set means all variables in set depend on X
 
 
-# the dependence graph
-depChildren = {}  # X:list means X depends on all variables in list
-depParents = {}  # X:list means all variables in list depend on X
+def initDepGraph(numvars):
+    global depChildren, depParents
+    depChildren = [None] * numvars
+    depParents = [None] * numvars
+
+
+# makes room in the dependency graph for the variables introduced while creating the RES
+def growDepGraph(numvars):
+    depChildren.extend([None] * (numvars - len(depChildren)))
+    depParents.extend([None] * (numvars - len(depParents)))
+
+
+# adds the edges from var to the variables in its right-hand side to the dependency graph
+def addDependencies(var, rhs):
+    depChildren[var] = set()
+    if depParents[var] is None:
+        depParents[var] = set()
+
+    for depVar in rhs.getVariables():
+        depChildren[var].add(depVar)
+        if depParents[depVar] is None:
+            depParents[depVar] = {var}
+        else:
+            depParents[depVar].add(var)
 
 
 def createRES(formula, ts, makeDepGraph):
@@ -157,101 +293,95 @@ def createRES(formula, ts, makeDepGraph):
     if formula.op.type not in ["LEASTFP", "GREATESTFP"]:
         formula = FormulaNode([[OperatorNode([OperatorNode(["Q"], "VAR")], "LEASTFP"), formula]])
     fixpoints = formula.getSubFormulas(["LEASTFP", "GREATESTFP"])
+    indexFixpoints(fixpoints)
+    fixQualitativeVariables(fixpoints)
+    numvars = len(fixpoints) * model.numstates
+    if makeDepGraph:
+        initDepGraph(numvars)
     equations = []
     for fixf in fixpoints:
         sign = "mu" if fixf.op.type == "LEASTFP" else "nu"
         for state in range(0, model.numstates):
-            var = fixf.op.var + str(state)
-            rhs = RHS(state, fixf.subformulas[0])
-            equation = RealEquation(sign, var, simplify(toNormalForm(simplify(rhs)), True))
-            equations += [equation]
+            var = fixpointIndex[fixf.op.var] * model.numstates + state
+            rhs = valueFormula(fixedValues[var]) if var in fixedValues else RHS(state, fixf.subformulas[0])
+            newEquations = createEquations(sign, var, rhs)
+            equations += newEquations
 
             if makeDepGraph:
-                depChildren[var] = set()
-                if var not in depParents:
-                    depParents[var] = set()
-
-                # create edges in the dependency graph
-                for varFormula in equation.rhs.getSubFormulas(["VAR"]):
-                    depVar = varFormula.op.var
-
-                    depChildren[var].add(depVar)
-                    if depVar not in depParents:
-                        depParents[depVar] = {var}
-                    else:
-                        depParents[depVar].add(var)
+                growDepGraph(numvars + len(auxNames))
+                for equation in newEquations:
+                    addDependencies(equation.lhs, equation.rhs)
 
-    return RealEquationSystem(equations, formula.op.var + str(ts.initstate))
+    return RealEquationSystem(equations, ts.initstate, numvars + len(auxNames))
 
 
 def createLocalRES(formula, ts, SCC, makeDepGraph):
-    global model, depChildren, depParents
+    global model
     model = ts
-    depChildren = {}
-    depParents = {}
 
     # alter the formula so that it starts with a fixpoint operator
     if formula.op.type not in ["LEASTFP", "GREATESTFP"]:
         formula = FormulaNode([[OperatorNode([OperatorNode(["Q"], "VAR")], "LEASTFP"), formula]])
     fixpoints = formula.getSubFormulas(["LEASTFP", "GREATESTFP"])
-    indexedFixpoints = {fix.op.var: fix for fix in fixpoints}
-    signs = {fix.op.var: ('mu' if fix.op.type == "LEASTFP" else 'nu') for fix in fixpoints}
-
-    # initialize blocks
-    varRank = {}
+    indexFixpoints(fixpoints)
+    fixQualitativeVariables(fixpoints)
+    numvars = len(fixpoints) * model.numstates
+    if makeDepGraph:
+        initDepGraph(numvars)
+    signs = ['mu' if fix.op.type == "LEASTFP" else 'nu' for fix in fixpoints]
+
+    # initialize blocks, the rank of each fixpoint
+    varRank = [0] * len(fixpoints)
     blockRank = 0
     if SCC:
-        blockSign = signs[fixpoints[0].op.var]
-        for fixf in fixpoints:
-            if signs[fixf.op.var] != blockSign:
+        blockSign = signs[0]
+        for i in range(len(fixpoints)):
+            if signs[i] != blockSign:
                 blockRank += 1
-                blockSign = signs[fixf.op.var]
-            varRank[fixf.op.var] = blockRank
+                blockSign = signs[i]
+            varRank[i] = blockRank
     blocks = [[] for rank in range(blockRank + 1)]
 
     equations = []
-    initVar = fixpoints[0].op.var + str(ts.initstate)
+    initVar = ts.initstate
     varQueue = [initVar]
+    queued = bytearray(numvars)
+    queued[initVar] = 1
     varQueuePointer = 0
     while varQueuePointer < len(varQueue):
         var = varQueue[varQueuePointer]
-        rhs = RHS(int(var[1:]), indexedFixpoints[var[0]].subformulas[0])
-        eq = RealEquation(signs[var[0]], var, simplify(toNormalForm(simplify(rhs)), True))
-        equations += [eq]
+        fixIndex, state = divmod(var, model.numstates)
+        rhs = valueFormula(fixedValues[var]) if var in fixedValues else RHS(state, fixpoints[fixIndex].subformulas[0])
+        newEquations = createEquations(signs[fixIndex], var, rhs)
+        equations += newEquations
+        # introduced variables already have an equation
+        queued.extend(b'\x01' * (numvars + len(auxNames) - len(queued)))
 
         if SCC:
-            blocks[varRank[var[0]]] += [eq]
+            blocks[varRank[fixIndex]] += newEquations
 
         if makeDepGraph:
-            depChildren[var] = set()
-            if var not in depParents:
-                depParents[var] = set()
+            growDepGraph(numvars + len(auxNames))
+            for eq in newEquations:
+                addDependencies(eq.lhs, eq.rhs)
 
-        # add all variables that eq depends on to the queue (if not there already)
-        for varFormula in eq.rhs.getSubFormulas(["VAR"]):
-            newVar = varFormula.op.var
-            if newVar not in varQueue:
-                varQueue += [newVar]
-
-            if makeDepGraph:
-                # create edges in the dependency graph
-                depChildren[var].add(newVar)
-                if newVar not in depParents:
-                    depParents[newVar] = {var}
-                else:
-                    depParents[newVar].add(var)
+        # add all variables that the equations depend on to the queue (if not there already)
+        for eq in newEquations:
+            for newVar in eq.rhs.getVariables():
+                if not queued[newVar]:
+                    queued[newVar] = 1
+                    varQueue += [newVar]
 
         varQueuePointer += 1
 
-    res = RealEquationSystem(equations, initVar)
+    res = RealEquationSystem(equations, initVar, numvars + len(auxNames))
     createEnd = time.clock()
 
     # sort so that we can compare the solving time it to non-local version
+    #   the order of the variables is exactly the order of the fixpoints and then the states
+    #   where introduced variables come directly after the variable they were introduced for
     if not SCC:
-        fixpointVars = [fix.op.var for fix in fixpoints]
-        toSort = [(var[0], var[1:]) for var in res.indexedEquations.keys()]
-        toSort.sort(key=lambda x: (fixpointVars.index(x[0]), int(x[1])))
-        res = RealEquationSystem([res.indexedEquations[v + s] for (v, s) in toSort], res.initVar)
+        res.equations.sort(key=lambda eq: (auxParents.get(eq.lhs, eq.lhs), eq.lhs))
     else:
         res.blocks = blocks
         res.varRank = varRank
@@ -266,9 +396,12 @@ def solveEquationApprox(equation):
     newrhs = valueFormula(0.0 if equation.sign == "mu" else 1.0)
     iter = 0
     while oldrhs != newrhs and iter < MAX_ITER:
-        oldrhs = copy.deepcopy(newrhs)
-        newrhs = simplify(toNormalForm(substituteVar(copy.deepcopy(equation.rhs), var, oldrhs)), True)
+        oldrhs = newrhs
+        newrhs = simplify(toNormalForm(substituteVar(equation.rhs, var, oldrhs)), True)
         iter += 1
+        # once the right-hand side is a value, stop when it is precise enough
+        if oldrhs.op.type == "VAL" and newrhs.op.type == "VAL" and abs(newrhs.op.val - oldrhs.op.val) < PRECISION:
+            break
         # print("iteration " + str(iter) + ": " + var + " = " + str(newrhs))
     equation.rhs = newrhs
     return equation
@@ -283,29 +416,16 @@ def solveForVar(formula, var, sign):
     if not formula.containsVar(var):
         return formula
     else:
-        # solve (linear)
-        if formula.op.type == "VAR":
-            return valueFormula(0.0 if sign == "mu" else 1.0)
-        elif formula.op.type == "MULTIPLY":
-            return valueFormula(0.0)
-        else:
-            operandWithVar = [operand for operand in formula.operands if operand.containsVar(var)][0]
-            if operandWithVar.op.type == "VAR":
-                # print("found formula of form X = X + f, which may not have a solution")
-                raise ZeroDivisionError
-            else:
-                val = [term.op.val for term in operandWithVar.operands if term.op.type == "VAL"][0]
-                operandsWithoutVar = [operand for operand in formula.operands if not operand.containsVar(var)]
-                scalar = 1.0 / (1.0 - val)
-                if len(operandsWithoutVar) == 1:
-                    scaledrhs = RealFormulaNode(RealOperatorNode("MULTIPLY"),
-                                                [valueFormula(scalar), operandsWithoutVar[0]])
-                else:
-                    scaledrhs = RealFormulaNode(RealOperatorNode("MULTIPLY"),
-                                                [valueFormula(scalar), RealFormulaNode(
-                                                                     RealOperatorNode("ADD"), operandsWithoutVar)
-                                                 ])
-                return simplify(toNormalForm(scaledrhs), True)
+        # solve (linear): X = c + p*X + f gives X = (c + f) / (1 - p)
+        term = formula.op.term
+        scalar = term.coefficients[var]
+        rest = term.without(var)
+        if scalar == 1.0:
+            if rest.constant == 0.0 and not rest.coefficients:
+                return valueFormula(0.0 if sign == "mu" else 1.0)
+            # print("found formula of form X = X + f, which may not have a solution")
+            raise ZeroDivisionError
+        return linearFormula(rest.scale(1.0 / (1.0 - scalar)), formula.isImportant())
 
 
 # uses math to solve equation
@@ -313,13 +433,14 @@ def solveForVar(formula, var, sign):
 def solveEquation(equation):
     # print("solving " + str(equation.rhs) + " for " + equation.lhs)
     if equation.rhs.op.type in ["MAXIMUM", "MINIMUM"]:
-        for i in range(len(equation.rhs.operands)):
-            operand = equation.rhs.operands[i]
+        operands = []
+        for operand in equation.rhs.operands:
             if operand.op.type == "MINIMUM":
-                for j in range(len(operand.operands)):
-                    operand.operands[j] = solveForVar(operand.operands[j], equation.lhs, equation.sign)
+                operands += [withOperands(operand, [solveForVar(subOperand, equation.lhs, equation.sign)
+                                                    for subOperand in operand.operands])]
             else:
-                equation.rhs.operands[i] = solveForVar(operand, equation.lhs, equation.sign)
+                operands += [solveForVar(operand, equation.lhs, equation.sign)]
+        equation.rhs = withOperands(equation.rhs, operands)
     else:
         equation.rhs = solveForVar(equation.rhs, equation.lhs, equation.sign)
     if printInfo:
@@ -339,6 +460,14 @@ def depSet(parent, children):
         depParents[var].add(parent)
 
 
+# substitutes 'new' for var in right-hand side rhs and brings the result back to normal form
+# the right-hand side is returned unchanged if it does not contain var
+def substituteRHS(rhs, var, new):
+    if not rhs.containsVar(var):
+        return rhs
+    return simplify(toNormalForm(simplify(substituteVar(rhs, var, new))), True)
+
+
 def solveRES(res, useDepGraph):
     if printInfo:
         print("##### SOLVING RES #####")
@@ -346,28 +475,28 @@ def solveRES(res, useDepGraph):
         equation = res.equations[i]
         var = equation.lhs
         if printInfo:
-            print("##### handling " + var)
+            print("##### handling " + varName(var))
         # solve own equation if necessary
         if equation.rhs.containsVar(var):
             if printInfo:
                 print("##### solving...")
             equation.rhs = simplify(solveEquation(equation).rhs, True)
             if useDepGraph:
-                depSet(var, set(v.op.var for v in equation.rhs.getSubFormulas(["VAR"])))
+                depSet(var, equation.rhs.getVariables())
 
         # substitute above
         if printInfo:
             print("##### substituting...")
         if useDepGraph:
-            for parentVar in copy.copy(depParents[var]):
+            for parentVar in list(depParents[var]):
                 eq = res.indexedEquations[parentVar]
                 if not eq.processed:
-                    eq.rhs = simplify(toNormalForm(simplify(substituteVar(eq.rhs, var, equation.rhs))), True)
-                    depSet(parentVar, set(v.op.var for v in eq.rhs.getSubFormulas(["VAR"])))
+                    eq.rhs = substituteRHS(eq.rhs, var, equation.rhs)
+                    depSet(parentVar, eq.rhs.getVariables())
         else:
             for j in reversed(range(0, i)):
                 eq = res.equations[j]
-                eq.rhs = simplify(toNormalForm(simplify(substituteVar(eq.rhs, var, equation.rhs))), True)
+                eq.rhs = substituteRHS(eq.rhs, var, equation.rhs)
 
         equation.processed = True
         if printInfo:
@@ -377,7 +506,8 @@ def solveRES(res, useDepGraph):
     nextEquation = res.equations[i]
     while nextEquation.lhs != res.initVar:
         for j in range(i+1, len(res.equations)):
-            res.equations[j].rhs = simplify(substituteVar(res.equations[j].rhs, res.equations[i].lhs, res.equations[i].rhs))
+            if res.equations[j].rhs.containsVar(res.equations[i].lhs):
+                res.equations[j].rhs = simplify(substituteVar(res.equations[j].rhs, res.equations[i].lhs, res.equations[i].rhs))
         i += 1
         nextEquation = res.equations[i]
     return float(res.equations[i].rhs.op.val)
@@ -411,11 +541,12 @@ def solveRESSCC(res):
         #  note that this dependency graph is only used to determine the ordering of solving the equations,
         #  it is not altered during solving
         if numBlocks == 1:
-            blockDepChildren = depChildren
+            blockDepChildren = {eq.lhs: depChildren[eq.lhs] for eq in res.blocks[rank]}
         else:
             blockDepChildren = {}
             for eq in res.blocks[rank]:
-                blockDepChildren[eq.lhs] = set([child for child in depChildren[eq.lhs] if res.varRank[child[0]] == rank])
+                blockDepChildren[eq.lhs] = set([child for child in depChildren[eq.lhs]
+                                                if res.varRank[fixpointOf(child)] == rank])
 
         # apply tarjan's algorithm to get all SCC's
         SCCs = tarjan(blockDepChildren)
@@ -424,6 +555,14 @@ def solveRESSCC(res):
         #  which is exactly the order we want for solving
         for i in range(len(SCCs)):
             SCC = SCCs[i]
+            if len(SCC) > 1 and usePolicy:
+                values = NumericRESSolver.solveSCC([res.indexedEquations[var] for var in SCC])
+                if values is not None:
+                    if printInfo:
+                        print("##### solved SCC of " + str(len(SCC)) + " variables by policy iteration")
+                    for var in SCC:
+                        res.indexedEquations[var].rhs = valueFormula(values[var])
+                        depSet(var, frozenset())
             if len(SCC) > 1:
                 # order the vertices in the SCC in reversed order of BFS
                 if rank == 0 and i == len(SCCs) - 1:
@@ -440,7 +579,7 @@ def solveRESSCC(res):
                         SCC = reversedOrderBFS(SCC, startingVertices, blockDepChildren)
             for var in SCC:
                 if printInfo:
-                    print("##### handling " + var)
+                    print("##### handling " + varName(var))
                 equation = res.indexedEquations[var]
 
                 # solve own equation if necessary
@@ -448,16 +587,16 @@ def solveRESSCC(res):
                     if printInfo:
                         print("##### solving...")
                     equation.rhs = simplify(solveEquation(equation).rhs, True)
-                    depSet(var, set(v.op.var for v in equation.rhs.getSubFormulas(["VAR"])))
+                    depSet(var, equation.rhs.getVariables())
 
                 # substitute to parents
                 if printInfo:
                     print("##### substituting...")
-                for parentVar in copy.copy(depParents[var]):
+                for parentVar in list(depParents[var]):
                     eq = res.indexedEquations[parentVar]
                     if not eq.processed:
-                        eq.rhs = simplify(toNormalForm(simplify(substituteVar(eq.rhs, var, equation.rhs))), True)
-                        depSet(parentVar, set(v.op.var for v in eq.rhs.getSubFormulas(["VAR"])))
+                        eq.rhs = substituteRHS(eq.rhs, var, equation.rhs)
+                        depSet(parentVar, eq.rhs.getVariables())
 
                 equation.processed = True
 
@@ -467,27 +606,45 @@ def solveRESSCC(res):
     return float(res.indexedEquations[res.initVar].rhs.op.val)
 
 
-def initRESSolver(ts, formula, store, verbose, local, depGraph, SCC):
-    global printInfo
+# solves the RES as it is by NumericRESSolver, where the fixpoints are nested in the order of their index
+#   the dependencies are taken from the right-hand sides, since solving may have changed them
+def solveNumerically(res, precision, maxIter):
+    children = {eq.lhs: set(eq.rhs.getVariables()) for eq in res.equations}
+    return NumericRESSolver.solveRES(res, children, fixpointOf, precision, maxIter)
+
+
+# engine "symbolic" solves the RES by Gauss elimination, "numeric" by value iteration per SCC (see NumericRESSolver)
+#   the numeric engine always creates a local RES with dependency graph and stores its bounds in 'bounds'
+def initRESSolver(ts, formula, store, verbose, local, depGraph, SCC, policy=False, engine="symbolic",
+                  precision=NumericRESSolver.EPSILON, maxIter=NumericRESSolver.MAXITER, qualitative=False):
+    global printInfo, usePolicy, bounds, useQualitative
     printInfo = verbose
+    usePolicy = policy
+    useQualitative = qualitative
+    NumericRESSolver.printInfo = verbose
+    bounds = None
+    if engine == "numeric":
+        local = depGraph = SCC = True
 
     # for now, we do not allow formulas with the operators PRODUCT and COPRODUCT
     if formula.getSubFormulas(["PRODUCT", "COPRODUCT"]):
         print("Operators product (*) and coproduct (#) are not supported")
         return None, 0, 0
 
+    clearNodes()
     createStart = time.clock()
-    if depGraph:
-        global depChildren, depParents
-        depChildren = {}
-        depParents = {}
-    if local:
-        result = createLocalRES(formula, ts, SCC, depGraph)
-        res = result[0]
-        createEnd = result[1]
-    else:
-        res = createRES(formula, ts, depGraph)
-        createEnd = time.clock()
+    try:
+        if local:
+            result = createLocalRES(formula, ts, SCC, depGraph)
+            res = result[0]
+            createEnd = result[1]
+        else:
+            res = createRES(formula, ts, depGraph)
+            createEnd = time.clock()
+    except DistributionTooLarge as err:
+        RealFormula.auxiliaryVariable = None
+        print("Could not bring a right-hand side to normal form: " + str(err))
+        return None, 0, 0
 
     if store:
         f = open(os.path.sep.join([os.path.split(model.file)[0],
@@ -499,12 +656,12 @@ def initRESSolver(ts, formula, store, verbose, local, depGraph, SCC):
                                    ts.name + "_" + formula.name + "_DEP" + ("_local" if local else "") + ".dot"]), 'w')
 
             dot = "digraph DEP {\nrankdir = TB;\n"
-            for var in depChildren:
-                dot += '\t' + var + ";\n"
+            for eq in res.equations:
+                dot += '\t' + varName(eq.lhs) + ";\n"
             dot += '\n'
-            for parent in depChildren:
-                for child in depChildren[parent]:
-                    dot += '\t' + parent + " -> " + child + ";\n"
+            for eq in res.equations:
+                for child in depChildren[eq.lhs]:
+                    dot += '\t' + varName(eq.lhs) + " -> " + varName(child) + ";\n"
             dot += "}"
 
             d.write(dot)
@@ -514,12 +671,26 @@ def initRESSolver(ts, formula, store, verbose, local, depGraph, SCC):
 
     solveStart = time.clock()
     try:
-        if SCC:
+        if engine == "numeric":
+            value, lower, upper = NumericRESSolver.solveRES(res, depChildren,
+                                                            lambda var: res.varRank[fixpointOf(var)],
+                                                            precision, maxIter)
+            bounds = (lower, upper)
+        elif SCC:
             value = solveRESSCC(res)
         else:
             value = solveRES(res, depGraph)
     except ZeroDivisionError:
         value = None
+    except DistributionTooLarge as err:
+        # every elimination step keeps the RES equivalent and in normal form, so the numeric engine solves what is left
+        print("Could not bring a right-hand side to normal form: " + str(err) + ", solving the RES numerically")
+        value, lower, upper = solveNumerically(res, precision, maxIter)
+        bounds = (lower, upper)
     solveEnd = time.clock()
 
+    if printInfo:
+        print("##### largest distribution: " + str(RealFormula.peakSize) + " operands, "
+              + str(len(auxNames)) + " variables introduced")
+
     return value, createEnd - createStart, solveEnd - solveStart
@@ -1,4 +1,3 @@
-import copy
 
 
 # defines a real formula and operators on it
@@ -10,42 +9,114 @@ import copy
 #   where p in [0,1] and c in [-1,1]
 # note that handling subtraction like this causes that not all RESs can be created from plmu model checking problems,
 #   but implementation wise it makes life easier
+# in normal form the sums are represented by a single LINEAR node holding a LinearTerm c + sum{p*X},
+#   so a normal form is max{min{LINEAR}}, where a LINEAR without variables is just a VAL
+# passes over formulas use an explicit stack instead of recursion, since formulas can become very deep by substitution
 
+import numpy as np
+
+
+# gives the name of a variable when printing, can be replaced to give (integer) variables a readable name
+def variableName(var):
+    return str(var)
+
+
+# a linear term c + sum{p*X}, where the coefficients p are stored per variable X
+class LinearTerm:
+    __slots__ = ['constant', 'coefficients']
+
+    def __init__(self, constant=0.0, coefficients=None):
+        self.constant = constant
+        if coefficients is None:
+            coefficients = {}
+        self.coefficients = coefficients
+
+    def add(self, other):
+        coefficients = dict(self.coefficients)
+        for var, p in other.coefficients.items():
+            coefficients[var] = coefficients.get(var, 0.0) + p
+        return LinearTerm(self.constant + other.constant, coefficients)
+
+    def scale(self, factor):
+        return LinearTerm(self.constant * factor, {var: p * factor for var, p in self.coefficients.items()})
+
+    # returns the term where var is replaced by the term 'term'
+    def substitute(self, var, term):
+        scalar = self.coefficients[var]
+        coefficients = dict(self.coefficients)
+        del coefficients[var]
+        for otherVar, p in term.coefficients.items():
+            coefficients[otherVar] = coefficients.get(otherVar, 0.0) + scalar * p
+        return LinearTerm(self.constant + scalar * term.constant, coefficients)
+
+    # returns the term without var
+    def without(self, var):
+        coefficients = dict(self.coefficients)
+        del coefficients[var]
+        return LinearTerm(self.constant, coefficients)
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.constant == other.constant and self.coefficients == other.coefficients
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, self.__class__):
+            return not self == other
+        return NotImplemented
+
+    def __str__(self):
+        terms = [str(p) + " * " + variableName(var) if p != 1.0 else variableName(var) for var, p in self.coefficients.items()]
+        if self.constant != 0.0 or not terms:
+            terms = [str(self.constant)] + terms
+        return terms[0] if len(terms) == 1 else "(" + " + ".join(terms) + ")"
+
+    def __repr__(self):
+        return "LINEAR(" + str(self.constant) + ", {" \
+               + ", ".join(variableName(var) + ": " + str(p) for var, p in self.coefficients.items()) + "})"
+
+
+# formula nodes are never changed after creation, so subformulas can be shared between formulas and equations
+# nodes should be created with makeNode, such that structurally equal formulas are the same object
 class RealFormulaNode:
 
-    def __init__(self, operator, operands=None):
-        self.important = False
+    def __init__(self, operator, operands=(), important=False):
+        self.important = important
         self.op = operator
-        if operands is None:
-            operands = []
         self.operands = operands
-        if len(operands) == 0:  # in case of VAL, VAR
+        # the variables of the formula, computed when first needed
+        self.variables = None
+        if len(operands) == 0:  # in case of VAL, VAR, LINEAR
             self.type = "NULLARY"
         else:  # possible in case of ADD, MULTIPLY, MAXIMUM and MINIMUM (2 or more operands)
             self.type = "MULTIARY"
 
-    # gets all subformulas with operator type in 'optypes'
-    def getSubFormulas(self, optypes):
-        subf = []
-        if self.op.type in optypes:
-            subf += [self]
-        for f in self.operands:
-            subf += f.getSubFormulas(optypes)
-        return subf
-
     def containsVar(self, var):
-        if self.type == "NULLARY":
-            if self.op.type == "VAR" and self.op.var == var:
-                return True
+        return var in self.getVariables()
+
+    # gets the set of all variables that appear in this formula
+    # computed bottom up with an explicit stack, for the subformulas that do not know their variables yet
+    def getVariables(self):
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            if node.variables is not None:
+                stack.pop()
+                continue
+            if node.op.type == "VAR":
+                node.variables = frozenset([node.op.var])
+            elif node.op.type == "LINEAR":
+                node.variables = frozenset(node.op.term.coefficients)
             else:
-                return False
-        else:
-            return any([subop.containsVar(var) for subop in self.operands])
+                unknown = [operand for operand in node.operands if operand.variables is None]
+                if unknown:
+                    stack += unknown
+                    continue
+                node.variables = frozenset().union(*[operand.variables for operand in node.operands])
+            stack.pop()
+        return self.variables
 
     # important means that it should not be removed during the simplification that removes terms form max/min
-    def makeImportant(self):
-        self.important = True
-
     def isImportant(self):
         return self.important
 
@@ -57,6 +128,8 @@ class RealFormulaNode:
             return self.op.val, {}
         elif self.op.type == "VAR":
             return 0.0, {self.op.var: 1}
+        elif self.op.type == "LINEAR":
+            return self.op.term.constant, self.op.term.coefficients
         elif self.op.type == "MULTIPLY":
             var = [term.op.var for term in self.operands if term.op.type == "VAR"][0]
             val = [term.op.val for term in self.operands if term.op.type == "VAL"][0]
@@ -71,23 +144,15 @@ class RealFormulaNode:
                 scalars.update(scalar)
             return value, scalars
 
-    def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.op == other.op \
-                   and len(self.operands) == len(other.operands) \
-                   and all([self.operands[i] == other.operands[i] for i in range(len(self.operands))])
-        return NotImplemented
-
-    def __ne__(self, other):
-        if isinstance(other, self.__class__):
-            return not self == other
-        return NotImplemented
+    # since nodes are hash-consed, equality and hashing are by identity
 
     def __str__(self):
         if self.op.type == "VAL":
             return str(self.op.val)
         elif self.op.type == "VAR":
-            return self.op.var
+            return variableName(self.op.var)
+        elif self.op.type == "LINEAR":
+            return str(self.op.term)
         elif self.op.type == "ADD":
             return "(" + " + ".join(str(operand) for operand in self.operands) + ")"
         elif self.op.type == "MULTIPLY":
@@ -101,7 +166,9 @@ class RealFormulaNode:
         if self.op.type == "VAL":
             return "VAL(" + str(self.op.val) + ')'
         elif self.op.type == "VAR":
-            return "VAR(" + self.op.var + ")"
+            return "VAR(" + variableName(self.op.var) + ")"
+        elif self.op.type == "LINEAR":
+            return repr(self.op.term)
         else:
             return self.op.type + "(" + ", ".join(repr(operand) for operand in self.operands) + ")"
 
@@ -112,6 +179,8 @@ class RealOperatorNode:
         self.type = type
         if type == "VAR":
             self.var = varorval
+        elif type == "LINEAR":
+            self.term = varorval
         else:
             self.val = varorval
 
@@ -119,7 +188,8 @@ class RealOperatorNode:
         if isinstance(other, self.__class__):
             return self.type == other.type \
                    and (self.var == other.var if self.type == "VAR" else True)\
-                   and (self.val == other.val if self.type == "VAL" else True)
+                   and (self.val == other.val if self.type == "VAL" else True)\
+                   and (self.term == other.term if self.type == "LINEAR" else True)
         return NotImplemented
 
     def __ne__(self, other):
@@ -128,22 +198,154 @@ class RealOperatorNode:
         return NotImplemented
 
 
-def valueFormula(value):
-    return RealFormulaNode(RealOperatorNode("VAL", value))
+# the largest number of operands a single distribution may create, see distribute
+MAX_COMBINATIONS = 10000
+# the number of linear operands of a minimum or maximum from which on dominated compares them on a dense matrix
+DENSE_DOMINANCE = 64
+# the largest number of operands created by a distribution since the last clearNodes
+peakSize = 0
+# gives a variable that stands for a formula that is too large to distribute over, None if this is not possible
+#   can be replaced to define the variable by a new equation, see distribute
+auxiliaryVariable = None
+
+
+# raised when a distribution would create more than MAX_COMBINATIONS operands and auxiliaryVariable is not set
+class DistributionTooLarge(Exception):
+    pass
+
+
+# all nodes by their structure, used to create every node only once (hash-consing)
+nodes = {}
+
+
+# gives the node with the given operator and operands, creating it only if it does not exist yet
+# operands are nodes themselves, so they can be compared by identity
+def makeNode(operator, operands=(), important=False):
+    operands = tuple(operands)
+    if operator.type == "VAR":
+        opKey = operator.var
+    elif operator.type == "LINEAR":
+        opKey = (operator.term.constant, frozenset(operator.term.coefficients.items()))
+    else:
+        opKey = operator.val
+    key = (operator.type, opKey, operands, important)
+    node = nodes.get(key)
+    if node is None:
+        node = RealFormulaNode(operator, operands, important)
+        nodes[key] = node
+    return node
+
+
+# forgets all nodes created so far
+def clearNodes():
+    global peakSize
+    nodes.clear()
+    peakSize = 0
+
+
+def valueFormula(value, important=False):
+    return makeNode(RealOperatorNode("VAL", value), (), important)
 
 
 def variableFormula(var):
-    return RealFormulaNode(RealOperatorNode("VAR", var))
+    return makeNode(RealOperatorNode("VAR", var))
+
+
+# gives the formula of a linear term, which is a value if it has no variables
+def linearFormula(term, important=False):
+    if term.coefficients:
+        return makeNode(RealOperatorNode("LINEAR", term), (), important)
+    return valueFormula(term.constant, important)
+
+
+# gives the linear term of a formula built from VAL, VAR, LINEAR, ADD and MULTIPLY (with at most one non-value operand)
+# returns None if the formula is not of that shape
+def toLinearTerm(formula):
+    if formula.op.type == "VAL":
+        return LinearTerm(formula.op.val)
+    elif formula.op.type == "VAR":
+        return LinearTerm(0.0, {formula.op.var: 1.0})
+    elif formula.op.type == "LINEAR":
+        return formula.op.term
+    elif formula.op.type in ["ADD", "MULTIPLY"]:
+        terms = [toLinearTerm(operand) for operand in formula.operands]
+        if None in terms:
+            return None
+        if formula.op.type == "ADD":
+            result = LinearTerm()
+            for term in terms:
+                result = result.add(term)
+            return result
+        nonConstants = [term for term in terms if term.coefficients]
+        if len(nonConstants) > 1:
+            return None
+        factor = 1.0
+        for term in terms:
+            if not term.coefficients:
+                factor *= term.constant
+        return nonConstants[0].scale(factor) if nonConstants else LinearTerm(factor)
+    return None
+
+
+# substitutes a formula 'new' for variable 'var' in linear term 'term'
+# since the term is increasing in var, substituting a max (min) gives the max (min) of the substitutions
+def substituteInTerm(term, var, new, important):
+    if new.op.type in ["MAXIMUM", "MINIMUM"]:
+        return makeNode(new.op, [substituteInTerm(term, var, operand, important)
+                                        for operand in new.operands])
+    newTerm = toLinearTerm(new)
+    if newTerm is None:
+        scaled = makeNode(RealOperatorNode("MULTIPLY"), [valueFormula(term.coefficients[var]), new])
+        return makeNode(RealOperatorNode("ADD"), [linearFormula(term.without(var)), scaled])
+    return linearFormula(term.substitute(var, newTerm), important)
+
+
+# returns formula with operands 'operands', which is formula itself if the operands did not change
+def withOperands(formula, operands):
+    if len(operands) == len(formula.operands):
+        for operand, oldOperand in zip(operands, formula.operands):
+            if operand is not oldOperand:
+                break
+        else:
+            return formula
+    return makeNode(formula.op, operands, formula.important)
+
+
+# rewrites formula bottom up with an explicit stack: first the operands of a node are rewritten,
+#   then 'function' is applied to the node with the rewritten operands
+# nodes for which 'keep' holds are not rewritten, and since nodes are shared every node is rewritten only once
+def rewrite(formula, function, keep=None):
+    done = {}
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in done:
+            stack.pop()
+            continue
+        if keep is not None and keep(node):
+            done[node] = node
+            stack.pop()
+            continue
+        pending = [operand for operand in node.operands if operand not in done]
+        if pending:
+            stack += pending
+            continue
+        stack.pop()
+        done[node] = function(withOperands(node, [done[operand] for operand in node.operands]))
+    return done[formula]
 
 
 # substitutes a formula 'new' for a variable 'var'
+# 'new' is not copied, it becomes a subformula of the result
 def substituteVar(formula, var, new):
-    if formula.op.type == "VAR" and formula.op.var == var:
-        return copy.deepcopy(new)
-    else:
-        for i in range(len(formula.operands)):
-            formula.operands[i] = substituteVar(formula.operands[i], var, new)
-    return formula
+    def substituteNode(node):
+        if node.op.type == "VAR":
+            return new
+        elif node.op.type == "LINEAR":
+            return substituteInTerm(node.op.term, var, new, node.isImportant())
+        return node
+
+    return rewrite(formula, substituteNode, lambda node: var not in node.getVariables())
 
 
 def applyOperator(opType, values):
@@ -160,10 +362,9 @@ def applyOperator(opType, values):
         return max(values)
 
 
-# returns whether operand1 is definitely worse than operand2 when put together in opType
-def isWorseOperand(operand1, operand2, opType):
-    val1, scalar1 = operand1.getVariableScalar()
-    val2, scalar2 = operand2.getVariableScalar()
+# returns whether the linear term val1 + sum{scalar1} is definitely worse than val2 + sum{scalar2} in opType,
+#   that is, smaller (MAXIMUM) or larger (MINIMUM) for all values of the variables in [0,1]
+def isWorseTerm(val1, scalar1, val2, scalar2, opType):
     if opType == "MAXIMUM":
         extra = 0.0
         for var in scalar1:
@@ -187,9 +388,71 @@ def isWorseOperand(operand1, operand2, opType):
     return True
 
 
+# gives per linear term in terms (None for an operand that is not linear) whether it is left out of opType because it is
+#   certainly worse than another term that is kept, where a term with protected[i] is never left out
+# a term can only be worse than a term with a better value when all variables are 0 and when all variables are 1, so
+#   the terms are visited from best to worst on those values and are only compared to the terms kept so far
+# from DENSE_DOMINANCE linear terms on, a term is compared to all kept terms at once on a dense matrix of coefficients
+def dominated(terms, protected, opType):
+    removed = [False] * len(terms)
+    linear = [i for i, term in enumerate(terms) if term is not None]
+    sign = -1.0 if opType == "MAXIMUM" else 1.0
+    linear.sort(key=lambda i: (sign * (terms[i].constant + sum(terms[i].coefficients.values())),
+                               sign * terms[i].constant))
+    kept = []
+    if len(linear) < DENSE_DOMINANCE:
+        for i in linear:
+            term = terms[i]
+            if not protected[i] and any(isWorseTerm(term.constant, term.coefficients,
+                                                    terms[j].constant, terms[j].coefficients, opType) for j in kept):
+                removed[i] = True
+            else:
+                kept += [i]
+        return removed
+
+    columns = {}
+    for i in linear:
+        for var in terms[i].coefficients:
+            columns.setdefault(var, len(columns))
+    constants = np.array([terms[i].constant for i in linear])
+    coefficients = np.zeros((len(linear), len(columns)))
+    present = np.zeros((len(linear), len(columns)), dtype=bool)
+    for row, i in enumerate(linear):
+        for var, p in terms[i].coefficients.items():
+            coefficients[row, columns[var]] = p
+            present[row, columns[var]] = True
+    for row, i in enumerate(linear):
+        if not protected[i] and kept:
+            # as in isWorseTerm: the variables of the larger term that the smaller term does not have count as 1 in
+            #   the larger one, and shared variables need a coefficient that is at least as large in the larger one
+            otherPresent = present[kept]
+            otherCoefficients = coefficients[kept]
+            shared = otherPresent & present[row]
+            if opType == "MAXIMUM":
+                extra = np.where(present[row] & ~otherPresent, coefficients[row], 0.0).sum(axis=1)
+                worse = (constants[row] + extra <= constants[kept]) \
+                    & ~(shared & (coefficients[row] > otherCoefficients)).any(axis=1)
+            else:
+                extra = np.where(otherPresent & ~present[row], otherCoefficients, 0.0).sum(axis=1)
+                worse = (constants[kept] + extra <= constants[row]) \
+                    & ~(shared & (otherCoefficients > coefficients[row])).any(axis=1)
+            if worse.any():
+                removed[i] = True
+                continue
+        kept += [row]
+    return removed
+
+
+# returns a new formula if anything changed
 def simplify(formula, afterNormalForm=False):
-    for i in range(len(formula.operands)):
-        formula.operands[i] = simplify(formula.operands[i], afterNormalForm)
+    return rewrite(formula, lambda node: simplifyNode(node, afterNormalForm))
+
+
+# simplifies the top of a formula of which the operands are already simplified
+def simplifyNode(formula, afterNormalForm):
+    # in normal form a variable is a linear term
+    if afterNormalForm and formula.op.type == "VAR":
+        return linearFormula(toLinearTerm(formula), formula.isImportant())
 
     # print("simplifying " + str(formula))
 
@@ -240,135 +503,207 @@ def simplify(formula, afterNormalForm=False):
 
             # some simplifications assuming normal form
             if afterNormalForm:
-                # combine additions of variables (assumes normal form)
-                if opType == "ADD":
-                    multOperands = [operand for operand in newOperands if operand.op.type == "MULTIPLY"]
-                    nonMultOperands = [operand for operand in newOperands if operand.op.type != "MULTIPLY"]
-                    if len(multOperands) > 1:
-                        varScalars = {}
-                        for mult in multOperands:
-                            var = [term.op.var for term in mult.operands if term.op.type == "VAR"][0]
-                            val = [term.op.val for term in mult.operands if term.op.type == "VAL"][0]
-                            if var in varScalars:
-                                varScalars[var] += val
-                            else:
-                                varScalars[var] = val
-
-                        newOperands = nonMultOperands \
-                                      + [RealFormulaNode(RealOperatorNode("MULTIPLY"),
-                                                         [valueFormula(varScalars[var]), variableFormula(var)]) for var in varScalars]
-                        if len(newOperands) == 1:
-                            return newOperands[0]
+                # combine sums into a single linear term (assumes normal form)
+                if opType in ["ADD", "MULTIPLY"]:
+                    term = toLinearTerm(withOperands(formula, newOperands))
+                    if term is not None:
+                        return linearFormula(term, formula.isImportant())
 
                 # remove duplicate and worse operands in minimum and maximum
                 if opType in ["MINIMUM", "MAXIMUM"]:
                     # remove duplicates
                     trimmedOperands = []
+                    found = set()
                     for operand in newOperands:
-                        alreadyFound = False
-                        for trimmedOperand in trimmedOperands:
-                            if operand == trimmedOperand:
-                                alreadyFound = True
-                        if not alreadyFound:
+                        if operand not in found:
+                            found.add(operand)
                             trimmedOperands += [operand]
                     newOperands = trimmedOperands
                     # if we are not dealing with MAXIMUM with MINIMUM terms, remove terms that are certainly worse
                     if not any([operand.op.type == "MINIMUM" for operand in newOperands]):
-                        worseOperands = []
-                        for operand1 in newOperands:
-                            for operand2 in newOperands:
-                                if operand1 != operand2 and operand1 not in worseOperands and operand2 not in worseOperands:
-                                    if not operand1.isImportant() and isWorseOperand(operand1, operand2, opType):
-                                        worseOperands += [operand1]
-                                    elif not operand2.isImportant() and isWorseOperand(operand2, operand1, opType):
-                                        worseOperands += [operand2]
-                        newOperands = [operand for operand in newOperands if operand not in worseOperands]
+                        removed = dominated([toLinearTerm(operand) for operand in newOperands],
+                                            [operand.isImportant() for operand in newOperands], opType)
+                        newOperands = [operand for operand, worse in zip(newOperands, removed) if not worse]
                         if len(newOperands) == 1:
                             return newOperands[0]
 
-        formula.operands = newOperands
+        formula = withOperands(formula, newOperands)
 
     # print("result: " + str(formula))
     return formula
 
 
+# combines linear terms term1 and term2 with opType ADD or MULTIPLY
+# returns None if the result is not linear
+def combineTerms(term1, term2, opType):
+    if term1 is None or term2 is None:
+        return None
+    elif opType == "ADD":
+        return term1.add(term2)
+    elif not term2.coefficients:
+        return term1.scale(term2.constant)
+    elif not term1.coefficients:
+        return term2.scale(term1.constant)
+    return None
+
+
+# gives the largest c + sum{p} of the linear terms c + sum{p*X} in formula, a maximum or minimum of linear terms,
+#   which bounds its value when its variables are in [0,1]
+# returns None if formula has another shape or a negative c or p
+def probabilityMass(formula):
+    mass = 0.0
+    stack = [formula]
+    while stack:
+        node = stack.pop()
+        if node.op.type in ["MINIMUM", "MAXIMUM"]:
+            stack += node.operands
+            continue
+        term = toLinearTerm(node)
+        if term is None or term.constant < 0.0 or any(p < 0.0 for p in term.coefficients.values()):
+            return None
+        mass = max(mass, term.constant + sum(term.coefficients.values()))
+    return mass
+
+
+# multiplies formula, a maximum or minimum of linear terms, by factor
+def scaleFormula(formula, factor):
+    def scaleOperands(node):
+        return withOperands(node, [operand if operand.op.type in ["MINIMUM", "MAXIMUM"]
+                                   else linearFormula(toLinearTerm(operand).scale(factor), operand.isImportant())
+                                   for operand in node.operands])
+
+    return rewrite(formula, scaleOperands, lambda node: node.op.type not in ["MINIMUM", "MAXIMUM"])
+
+
+# leaves out the combinations (see distribute) with a linear term that is certainly worse than another in opType
+# combinations with an important operand are never left out
+def pruneCombinations(combinations, opType):
+    removed = dominated([term for combi, term, important in combinations],
+                        [important for combi, term, important in combinations], opType)
+    return [combination for combination, worse in zip(combinations, removed) if not worse]
+
+
 # applies distribution in formula over subOpType
 # for instance, formula = a*(b+c), subOpType = ADD, then result is a*b + a*c
 # also works for multiary cases
 # for instance formula = a*(b+c)*(d+e), subOpType = ADD then result is a*b*d + a*c*d + a*b*e + a*c*e
+# when distributing a sum or product over a minimum or maximum, combinations of which the (linear) sum or product is
+#   certainly worse than another one are left out while they are created, since extending them keeps them worse
+# if distributing over a minimum or maximum gives more than MAX_COMBINATIONS combinations, the subformula with the
+#   most operands is replaced by a variable from auxiliaryVariable, or DistributionTooLarge is raised if it is not set
+#   since variables are assumed to be in [0,1], the subformula f is replaced by m*Y with Y = f/m, where m bounds f
 # returns None if no distribution necessary
 def distribute(formula, subOpType):
+    global peakSize
     topop = formula.op
     distop = RealOperatorNode(subOpType)
-    toDistribute = [subf for subf in formula.operands if subf.op.type == subOpType]
-    # if there is nothing to distribute over, we are immediately done
-    if not toDistribute:
-        return None
-    otherOperands = [subf for subf in formula.operands if subf.op.type != subOpType]
-    distoperands = [[] for i in range(len(toDistribute))]
-
-    # collect all operands of the operands with subOpType
-    for i in range(len(toDistribute)):
-        distoperands[i] = toDistribute[i].operands
-
-    def makeCombinations(i):
-        if i < len(distoperands):
-            combis = makeCombinations(i + 1)
-            newCombis = []
-            for combi in combis:
-                for operand in distoperands[i]:
-                    newCombis += [[operand] + combi]
-            return newCombis
+    operands = list(formula.operands)
+    prune = topop.type in ["ADD", "MULTIPLY"] and subOpType in ["MINIMUM", "MAXIMUM"]
+    while True:
+        toDistribute = [subf for subf in operands if subf.op.type == subOpType]
+        # if there is nothing to distribute over, we are immediately done
+        if not toDistribute:
+            result = withOperands(formula, operands)
+            return None if result is formula else result
+        otherOperands = [subf for subf in operands if subf.op.type != subOpType]
+
+        # create all combinations of the operands of the operands with subOpType, such that they have one operand per
+        #   subOpType subformula, where the operands of the first subformula change fastest
+        # every combination is stored with its linear term (if pruning) and whether it has an important operand
+        term = None
+        if prune:
+            term = LinearTerm(0.0 if topop.type == "ADD" else 1.0)
+            for operand in otherOperands:
+                term = combineTerms(term, toLinearTerm(operand), topop.type)
+        combinations = [([], term, False)]
+        for subf in reversed(toDistribute):
+            terms = [toLinearTerm(operand) if prune else None for operand in subf.operands]
+            combinations = [([operand] + combi, combineTerms(combiTerm, operandTerm, topop.type),
+                             important or operand.isImportant())
+                            for combi, combiTerm, important in combinations
+                            for operand, operandTerm in zip(subf.operands, terms)]
+            if prune:
+                combinations = pruneCombinations(combinations, subOpType)
+            if subOpType != "ADD" and len(combinations) > MAX_COMBINATIONS:
+                break
         else:
-            return [[]]
-
-    # create all combinations of these operands such that they have one operand per subOpType subformula
-    combinations = makeCombinations(0)
+            break
+
+        # too many combinations, so the largest subformula becomes a variable
+        masses = {subf: probabilityMass(subf) for subf in toDistribute} if auxiliaryVariable is not None else {}
+        candidates = [subf for subf in toDistribute if masses.get(subf) is not None]
+        if not candidates:
+            raise DistributionTooLarge("distributing " + topop.type + " over " + subOpType + " gives more than "
+                                       + str(MAX_COMBINATIONS) + " operands")
+        largest = max(candidates, key=lambda subf: len(subf.operands))
+        mass = masses[largest]
+        if mass == 0.0:
+            operands[operands.index(largest)] = valueFormula(0.0)
+        else:
+            term = toLinearTerm(auxiliaryVariable(scaleFormula(largest, 1.0 / mass)))
+            operands[operands.index(largest)] = linearFormula(term.scale(mass))
 
     # create the new formula
     newOperands = []
-    for combi in combinations:
-        newOperand = RealFormulaNode(topop, otherOperands + combi)
-        if any([operand.isImportant() for operand in combi]):
-            newOperand.makeImportant()
-        newOperands += [newOperand]
-    return RealFormulaNode(distop, newOperands)
+    for combi, term, important in combinations:
+        newOperands += [makeNode(topop, otherOperands + combi, important)]
+    peakSize = max(peakSize, len(newOperands))
+    return makeNode(distop, newOperands)
 
 
 # changes a real formula to normal form: max{min{sum{p*X} + c}} where p in [0,1] and c in [-1,1]
 # requirement: operators have been flattened (formula is simplified
+# returns a new formula if anything changed
 def toNormalForm(formula):
-    for i in range(len(formula.operands)):
-        formula.operands[i] = toNormalForm(formula.operands[i])
-
-    # print("bringing " + str(formula) + " to normal form")
+    return rewrite(formula, normalizeNode)
 
-    if formula.type is "NULLARY":
-        # print("is NULLARY")
-        return formula
 
+# distributes the top of a formula over ADD, MINIMUM or MAXIMUM, in this order
+# returns None if no distribution necessary
+def distributeTop(formula):
     # distribute over ADD
     if formula.op.type == "MULTIPLY":
         result = distribute(formula, "ADD")
         if result:
-            formula = result
-            for i in range(len(formula.operands)):
-                formula.operands[i] = toNormalForm(formula.operands[i])
+            return result
     # distribute over MINIMUM
     if formula.op.type in ["ADD", "MULTIPLY"]:
         result = distribute(formula, "MINIMUM")
         if result:
-            formula = result
-            for i in range(len(formula.operands)):
-                formula.operands[i] = toNormalForm(formula.operands[i])
+            return result
     # distribute over MAXIMUM
     if formula.op.type in ["MINIMUM", "ADD", "MULTIPLY"]:
-        result = distribute(formula, "MAXIMUM")
-        if result:
-            formula = result
-            for i in range(len(formula.operands)):
-                formula.operands[i] = toNormalForm(formula.operands[i])
-
-    # print("result: " + str(formula))
-
-    return formula
+        return distribute(formula, "MAXIMUM")
+    return None
+
+
+# brings a formula of which the operands are already in normal form to normal form
+# the operands of a distributed formula are combinations of operands in normal form, so only their top is normalized,
+#   after which the top of the distributed formula itself may have to be distributed further
+def normalizeNode(formula):
+    normalized = {}
+    distributed = {}
+    stack = [formula]
+    while stack:
+        node = stack[-1]
+        if node in normalized:
+            stack.pop()
+            continue
+        if node not in distributed:
+            distributed[node] = distributeTop(node)
+        result = distributed[node]
+        if result is None:
+            normalized[node] = node
+            stack.pop()
+            continue
+        pending = [operand for operand in result.operands if operand not in normalized]
+        if pending:
+            stack += pending
+            continue
+        result = withOperands(result, [normalized[operand] for operand in result.operands])
+        if result in normalized:
+            normalized[node] = normalized[result]
+            stack.pop()
+        else:
+            stack += [result]
+    return normalized[formula]
@@ -1,4 +1,10 @@
+import gzip
+import io
+import lzma
 import os
+import re
+from array import array
+from bisect import bisect_right
 
 # format:
 
@@ -9,45 +15,136 @@ import os
 # <#states> and <#transitions> not mandatory
 # a state is represented by a natural number in the interval [0, #numstates-1]
 # a probability is represented by a positive rational number: nat/nat
+# the file may be compressed with gzip or xz
 
 
+# a view on a single transition of a TransitionSystem, the data itself is kept in the arrays of the system
 class Transition:
-    def __init__(self, startstate, action, enddist):
-        self.startstate = startstate
-        self.action = action
-        self.enddist = enddist
+    __slots__ = ['ts', 'index']
+
+    def __init__(self, ts, index):
+        self.ts = ts
+        self.index = index
+
+    @property
+    def startstate(self):
+        return bisect_right(self.ts.stateStart, self.index) - 1
+
+    @property
+    def action(self):
+        return self.ts.actions[self.ts.transAction[self.index]]
+
+    # the end states of the transition (zero-copy view)
+    @property
+    def targets(self):
+        return self.ts.targetsView[self.ts.distStart[self.index]:self.ts.distStart[self.index + 1]]
+
+    # the probabilities of the end states, in the same order as targets (zero-copy view)
+    @property
+    def probs(self):
+        return self.ts.probsView[self.ts.distStart[self.index]:self.ts.distStart[self.index + 1]]
+
+    @property
+    def enddist(self):
+        return dict(zip(self.targets, self.probs))
 
     def __repr__(self):
-        return '(' + str(self.startstate) + ', "' + self.action + '", ' + ' '.join(str(k) + ':' + str(v) for k, v in self.enddist.items()) + ')'
+        return '(' + str(self.startstate) + ', "' + self.action + '", ' + ' '.join(str(k) + ':' + str(v) for k, v in zip(self.targets, self.probs)) + ')'
+
+
+# the transitions with indices in [start, end), as returned by TransitionSystem.outgoing
+class TransitionRange:
+    __slots__ = ['ts', 'start', 'end']
+
+    def __init__(self, ts, start, end):
+        self.ts = ts
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("transition index out of range")
+        return Transition(self.ts, self.start + i)
 
+    def __iter__(self):
+        for index in range(self.start, self.end):
+            yield Transition(self.ts, index)
 
+
+# the transitions are stored in compressed sparse row format, sorted on (start state, action):
+#   the transitions of state s have indices [stateStart[s], stateStart[s+1])
+#   transition t has action actions[transAction[t]]
+#   and end states targets[distStart[t]:distStart[t+1]] with probabilities probs[distStart[t]:distStart[t+1]]
+# the transitions of a state with a given action form a slice, which is indexed in actionIndex
 class TransitionSystem:
-    def __init__(self, file, initData, transitions, labels, isProbabilistic):
+    def __init__(self, file, initData, sources, actions, distStart, targets, probs, actionNames, labels, isProbabilistic):
         self.file = file
-        self.name = os.path.splitext(os.path.basename(file))[0]
+        self.name = os.path.basename(file)
+        if self.name.endswith(('.gz', '.xz')):
+            self.name = self.name[:-3]
+        self.name = os.path.splitext(self.name)[0]
         self.initstate = int(initData[0])
 
         self.isProbabilistic = isProbabilistic
         if len(initData) > 1:
             self.numtransitions = int(initData[1])
         else:
-            self.numtransitions = len(transitions)
+            self.numtransitions = len(sources)
         if len(initData) > 2:
             self.numstates = int(initData[2])
         else:
-            states = set()
-            for t in transitions:
-                if t.startstate not in states:
-                    states.add(t.startstate)
-                for s in t.enddist:
-                    if s not in states:
-                        states.add(s)
-            self.numstates = len(states)
-
-        # index the transitions on start state for easy access
-        self.transitions = [[] for i in range(self.numstates)]
-        for t in transitions:
-            self.transitions[t.startstate] += [t]
+            self.numstates = max(max(sources, default=-1), max(targets, default=-1)) + 1
+
+        # intern the actions
+        self.actions = actionNames
+        self.actionIds = {action: aid for aid, action in enumerate(actionNames)}
+
+        # sort the transitions on start state using a counting sort, and then on action within each state
+        self.stateStart = array('l', bytes(array('l').itemsize * (self.numstates + 1)))
+        for source in sources:
+            self.stateStart[source + 1] += 1
+        for state in range(self.numstates):
+            self.stateStart[state + 1] += self.stateStart[state]
+        order = array('l', bytes(array('l').itemsize * len(sources)))
+        position = array('l', self.stateStart)
+        for t in range(len(sources)):
+            order[position[sources[t]]] = t
+            position[sources[t]] += 1
+        self.actionIndex = {}
+        numactions = len(actionNames)
+        for state in range(self.numstates):
+            start, end = self.stateStart[state], self.stateStart[state + 1]
+            if any(actions[order[i]] > actions[order[i + 1]] for i in range(start, end - 1)):
+                order[start:end] = array('l', sorted(order[start:end], key=lambda t: actions[t]))
+            # index the slice of each action
+            for i in range(start, end):
+                if i == start or actions[order[i]] != actions[order[i - 1]]:
+                    sliceStart = i
+                if i == end - 1 or actions[order[i]] != actions[order[i + 1]]:
+                    self.actionIndex[state * numactions + actions[order[i]]] = (sliceStart, i + 1)
+
+        # fill the sorted arrays, in case the input already was sorted the arrays can be used as they are
+        if all(order[t] == t for t in range(len(order))):
+            self.transAction = actions
+            self.distStart = distStart
+            self.targets = targets
+            self.probs = probs
+        else:
+            self.transAction = array('i', (actions[t] for t in order))
+            self.distStart = array('l', [0])
+            self.targets = array('l')
+            self.probs = array('d')
+            for t in order:
+                self.targets.extend(targets[distStart[t]:distStart[t + 1]])
+                self.probs.extend(probs[distStart[t]:distStart[t + 1]])
+                self.distStart.append(len(self.targets))
+        self.targetsView = memoryview(self.targets)
+        self.probsView = memoryview(self.probs)
 
         # normalize the labels to [0,1] and store the factor to return them to the original value
         self.labels = [0 for s in range(self.numstates)]
@@ -59,57 +156,99 @@ class TransitionSystem:
             if state in labels:
                 self.labels[state] = labels[state] / self.labelFactor
 
+    # the transitions of state with the given action, as a view on the transition arrays
     def outgoing(self, state, action):
-        return [t for t in self.transitions[state] if t.action == action]
+        aid = self.actionIds.get(action)
+        if aid is None:
+            return TransitionRange(self, 0, 0)
+        start, end = self.actionIndex.get(state * len(self.actions) + aid, (0, 0))
+        return TransitionRange(self, start, end)
+
+    # all transitions of state
+    def transitions(self, state):
+        return TransitionRange(self, self.stateStart[state], self.stateStart[state + 1])
 
     def __repr__(self):
-        return 'des (' + str(self.initstate) + ', ' + str(self.numtransitions) + ', ' + str(self.numstates) + ')\n' + '\n'.join(str(t) for s in self.transitions for t in s)
+        return 'des (' + str(self.initstate) + ', ' + str(self.numtransitions) + ', ' + str(self.numstates) + ')\n' + '\n'.join(str(t) for s in range(self.numstates) for t in self.transitions(s))
+
 
+# a transition line: (<start state>, "<action>", <distribution>), the action may also be unquoted
+TRANSITION = re.compile(r'\(\s*(\d+)\s*,\s*(?:"(.*)"|([^",]*?))\s*,\s*([0-9/\s]+?)\s*\)\s*$')
+BUFFERSIZE = 1 << 20
 
-def extractDist(distData):
-    prob = 1.0
-    dist = {}
-    for i in range(int(len(distData)/2)):
-        pValue = distData[2*i+1]
-        slash = pValue.find('/')
-        p = float(pValue[:slash]) / float(pValue[slash+1:])
-        dist[int(distData[2*i])] = p
-        prob -= p
 
-    dist[int(distData[-1])] = prob
-    return dist
+# opens a model file for reading text, gzip and xz compressed files are recognized by their magic bytes
+def openModel(filename):
+    with open(filename, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(b'\x1f\x8b'):
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(filename), BUFFERSIZE))
+    elif magic.startswith(b'\xfd7zXZ\x00'):
+        return io.TextIOWrapper(io.BufferedReader(lzma.open(filename), BUFFERSIZE))
+    else:
+        return open(filename, buffering=BUFFERSIZE)
 
 
 def readTS(filename):
     try:
-        f = open(filename)
-        lines = f.read().split('\n')
-        f.close()
+        f = openModel(filename)
     except IOError:
         print("File '" + filename + "' not found")
         return -1
 
     try:
-        isProbabilistic = False
-        labels = {}
-        initData = lines[0][lines[0].find('(') + 1:lines[0].rfind(')')].split(',')
-
-        transitionsData = lines[1:]
-        transitions = []
-        for t in transitionsData:
-            if t.startswith('('):
-                tData = t[t.find('(') + 1:t.rfind(')')].split(',')
-                beginState = int(tData[0])
-                action = ','.join(tData[1:-1]).strip()[1:-1]
-                distData = extractDist(tData[-1].strip().split(' '))
-                # extract label modeled as transition
-                if action.startswith("label(") and len(distData) == 1 and beginState in distData:
-                    value = float(action[action.find('(') + 1:action.rfind(')')])
-                    labels[beginState] = value
-                if len(distData) > 1:
+        with f:
+            header = f.readline()
+            initData = header[header.find('(') + 1:header.rfind(')')].split(',')
+
+            isProbabilistic = False
+            labels = {}
+            actionIds = {}
+            sources = array('l')
+            actions = array('i')
+            distStart = array('l', [0])
+            targets = array('l')
+            probs = array('d')
+            # probabilities tend to repeat, so parsed fractions are cached
+            fractions = {}
+            for line in f:
+                if not line.startswith('('):
+                    continue
+                match = TRANSITION.match(line)
+                if match is None:
+                    raise ValueError(line)
+                beginState = int(match.group(1))
+                action = match.group(2) if match.group(2) is not None else match.group(3)
+
+                # the last end state gets the remaining probability
+                prob = 1.0
+                tokens = iter(match.group(4).split())
+                for target in tokens:
+                    targets.append(int(target))
+                    fraction = next(tokens, None)
+                    if fraction is None:
+                        probs.append(prob)
+                    else:
+                        p = fractions.get(fraction)
+                        if p is None:
+                            numerator, slash, denominator = fraction.partition('/')
+                            p = fractions[fraction] = float(numerator) / float(denominator)
+                        probs.append(p)
+                        prob -= p
+                if len(targets) - distStart[-1] > 1:
                     isProbabilistic = True
-                transitions += [Transition(beginState, action, distData)]
-        return TransitionSystem(filename, initData, transitions, labels, isProbabilistic)
-    except (IndexError, ValueError):
+                distStart.append(len(targets))
+
+                # extract label modeled as transition
+                if action.startswith("label(") and distStart[-1] - distStart[-2] == 1 and targets[-1] == beginState:
+                    labels[beginState] = float(action[action.find('(') + 1:action.rfind(')')])
+
+                actionId = actionIds.get(action)
+                if actionId is None:
+                    actionId = actionIds[action] = len(actionIds)
+                sources.append(beginState)
+                actions.append(actionId)
+        return TransitionSystem(filename, initData, sources, actions, distStart, targets, probs, list(actionIds), labels, isProbabilistic)
+    except (IndexError, ValueError, OSError, EOFError):
         print("Supplied model is incorrectly specified. For syntax, see TSReader.py")
         return -1
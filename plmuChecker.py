@@ -1,80 +1,353 @@
-import copy
 import time
+import numpy as np
+from Qualitative import concatRanges, reachabilityShape, maximalEndComponents
 
 
+# maximum number of iterations per fixpoint, None for no maximum
 MAXITER = 1000
+# fixpoint iteration stops when no state changes more than EPSILON
+EPSILON = 1e-10
+# number of blocks of states that are updated one after the other in a Gauss-Seidel iteration
+BLOCKS = 32
 variables = {}
 model = None
 printInfo = False
+epsilon = EPSILON
+maxIter = MAXITER
+gaussSeidel = False
 
+# per action the transitions as arrays, see actionMatrix
+actionMatrices = {}
+# per fixpoint variable the nested fixpoint variables whose iterates become invalid when it changes
+resets = {}
+# per fixpoint variable the total number of iterations done and the largest residual it stopped with
+iterations = {}
+residuals = {}
+# for interval iteration: per fixpoint variable the largest gap between its upper and lower bound it stopped with
+gaps = {}
+# the states divided in blocks for Gauss-Seidel iteration
+stateBlocks = []
+# for interval iteration: the lower and upper bounds per fixpoint variable, the end components per fixpoint variable
+#   (see collectEndComponents) and the bounds of the last result
+lowerVariables = {}
+upperVariables = {}
+endComponents = {}
+bounds = None
 
-# naive method, approximates fixpoints
-def checkNaive(formula, state):
+
+# gives the transitions with the given action as a sparse matrix
+#   entryProbs and entryTargets are the non-zero entries of the matrix, row by row (one row per transition)
+#   rowStart gives the index of the first entry of each row (and the number of entries as last element)
+#   states are the states that have at least one such transition and stateStart the index of their first row
+#   stateRowStart gives for every state the index of its first row (and the number of rows as last element)
+def actionMatrix(action):
+    if action not in actionMatrices:
+        aid = model.actionIds.get(action)
+        stateStart = np.asarray(model.stateStart)
+        sources = np.repeat(np.arange(model.numstates), np.diff(stateStart))
+        rows = np.flatnonzero(np.asarray(model.transAction) == aid) if aid is not None else np.arange(0)
+        if len(rows) == 0:
+            actionMatrices[action] = None
+        else:
+            distStart = np.asarray(model.distStart)
+            counts = distStart[rows + 1] - distStart[rows]
+            entries = concatRanges(distStart[rows], counts)
+            rowStart = np.concatenate(([0], np.cumsum(counts)))
+            rowSources = sources[rows]
+            stateRows = np.flatnonzero(np.concatenate(([True], rowSources[1:] != rowSources[:-1])))
+            stateRowStart = np.concatenate(([0], np.cumsum(np.bincount(rowSources, minlength=model.numstates))))
+            actionMatrices[action] = (np.asarray(model.probs)[entries], np.asarray(model.targets)[entries],
+                                      rowStart, rowSources[stateRows], stateRows, stateRowStart)
+    return actionMatrices[action]
+
+
+# following Emerson-Lei, a nested fixpoint only has to restart from scratch when the variable of an enclosing fixpoint
+#   changes and there is a sign alternation between the two, otherwise its last iterate is a valid starting point
+# collects for every fixpoint variable in formula the nested variables that have to be reset
+def collectResets(formula, enclosing=None):
+    if formula.op.type in ["LEASTFP", "GREATESTFP"]:
+        resets[formula.op.var] = []
+        for var, fixType, alternated in enclosing or []:
+            if alternated or fixType != formula.op.type:
+                resets[var] += [formula.op.var]
+        enclosing = [(var, fixType, alternated or fixType != formula.op.type) for var, fixType, alternated in enclosing or []] \
+            + [(formula.op.var, formula.op.type, False)]
+    for subformula in formula.subformulas:
+        collectResets(subformula, enclosing)
+
+
+# orders the states in reverse breadth first order from the initial state, followed by the unreachable states,
+#   and divides them in blocks, such that the values of successors tend to be updated before those of their predecessors
+def createStateBlocks():
+    stateStart = np.asarray(model.stateStart)
+    distStart = np.asarray(model.distStart)
+    targets = np.asarray(model.targets)
+    visited = np.zeros(model.numstates, dtype=bool)
+    visited[model.initstate] = True
+    order = [np.array([model.initstate])]
+    frontier = order[0]
+    while len(frontier):
+        rows = concatRanges(stateStart[frontier], stateStart[frontier + 1] - stateStart[frontier])
+        successors = np.unique(targets[concatRanges(distStart[rows], distStart[rows + 1] - distStart[rows])])
+        frontier = successors[~visited[successors]]
+        visited[frontier] = True
+        order += [frontier]
+    order = np.concatenate([np.flatnonzero(~visited)[::-1]] + order)[::-1]
+    return [block for block in np.array_split(order, min(BLOCKS, model.numstates)) if len(block)]
+
+
+# returns whether formula contains a fixpoint operator
+def containsFixpoint(formula):
+    return formula.op.type in ["LEASTFP", "GREATESTFP"] or any(containsFixpoint(subf) for subf in formula.subformulas)
+
+
+# approximates fixpoints, evaluates formula for all states at once and returns the vector of values
+# if states is given (an array of states), only the values of those states are returned
+def checkVector(formula, states=None):
     global variables
+    numstates = model.numstates if states is None else len(states)
 
     if formula.type == "NULLARY":
         if formula.op.type == "VAL":
-            return formula.op.val
+            return np.full(numstates, formula.op.val)
         elif formula.op.type == "VAR":
-            return variables[formula.op.var][state]
+            return variables[formula.op.var] if states is None else variables[formula.op.var][states]
         elif formula.op.type == "LABEL":
-            return model.labels[state]
+            labels = np.asarray(model.labels, dtype=float)
+            return labels if states is None else labels[states]
     elif formula.type == "UNARY":
-        if formula.op.type == "DIAMOND":
-            val = 0.0
-            for t in model.outgoing(state, formula.op.action):
-                sum = 0.0
-                for s in t.enddist:
-                    sum += t.enddist[s] * checkNaive(formula.subformulas[0], s)
-                if sum > val:
-                    val = sum
-            return val
-        elif formula.op.type == "BOX":
-            val = 1.0
-            for t in model.outgoing(state, formula.op.action):
-                sum = 0.0
-                for s in t.enddist:
-                    sum += t.enddist[s] * checkNaive(formula.subformulas[0], s)
-                if sum < val:
-                    val = sum
-            return val
+        if formula.op.type in ["DIAMOND", "BOX"]:
+            isDiamond = formula.op.type == "DIAMOND"
+            matrix = actionMatrix(formula.op.action)
+            vals = np.full(numstates, 0.0 if isDiamond else 1.0)
+            if matrix is not None:
+                entryProbs, entryTargets, rowStart, matrixStates, stateStart, stateRowStart = matrix
+                if states is not None:
+                    # restrict the matrix to the rows of the given states
+                    stateRowCounts = stateRowStart[states + 1] - stateRowStart[states]
+                    rows = concatRanges(stateRowStart[states], stateRowCounts)
+                    if len(rows) == 0:
+                        return vals
+                    rowCounts = rowStart[rows + 1] - rowStart[rows]
+                    entries = concatRanges(rowStart[rows], rowCounts)
+                    entryProbs = entryProbs[entries]
+                    entryTargets = entryTargets[entries]
+                    rowStart = np.concatenate(([0], np.cumsum(rowCounts)))
+                    matrixStates = np.flatnonzero(stateRowCounts)
+                    stateStart = (np.cumsum(stateRowCounts) - stateRowCounts)[matrixStates]
+                # only evaluate the subformula on the targets if there are fewer of them than states
+                if states is not None and len(entryTargets) < model.numstates:
+                    subTargets = checkVector(formula.subformulas[0], entryTargets)
+                else:
+                    subTargets = checkVector(formula.subformulas[0])[entryTargets]
+                sums = np.add.reduceat(entryProbs * subTargets, rowStart[:-1])
+                if isDiamond:
+                    vals[matrixStates] = np.maximum(np.maximum.reduceat(sums, stateStart), 0.0)
+                else:
+                    vals[matrixStates] = np.minimum(np.minimum.reduceat(sums, stateStart), 1.0)
+            return vals
         elif formula.op.type in ["LEASTFP", "GREATESTFP"]:
             i = 0
             var = formula.op.var
-            newVars = ([0.0] if formula.op.type == "LEASTFP" else [1.0]) * model.numstates
-            while variables[var] != newVars and i < MAXITER:
-                variables[var] = copy.copy(newVars)
-                for s in range(model.numstates):
-                    newVars[s] = checkNaive(formula.subformulas[0], s)
+            # start from scratch only if reset, else continue from the last iterate
+            if variables[var] is None:
+                variables[var] = np.full(model.numstates, 0.0 if formula.op.type == "LEASTFP" else 1.0)
+            # Gauss-Seidel iteration updates the blocks of states in place, which is only done for innermost fixpoints
+            inPlace = gaussSeidel and not containsFixpoint(formula.subformulas[0])
+            residual = 1.0
+            while residual >= epsilon and (maxIter is None or i < maxIter):
+                for nestedVar in resets[var]:
+                    variables[nestedVar] = None
+                if inPlace:
+                    oldVars = variables[var]
+                    variables[var] = oldVars.copy()
+                    for block in stateBlocks:
+                        variables[var][block] = checkVector(formula.subformulas[0], block)
+                    newVars = variables[var]
+                else:
+                    oldVars = variables[var]
+                    newVars = checkVector(formula.subformulas[0])
+                residual = np.max(np.abs(newVars - oldVars), initial=0.0)
+                variables[var] = newVars
                 if printInfo:
-                    print("Iteration " + str(i) + ": " + str(variables))
+                    print("Iteration " + str(i) + ": " + str(variables) + ", residual " + str(residual))
+                i += 1
+            iterations[var] += i
+            residuals[var] = max(residuals[var], residual)
+            return variables[var] if states is None else variables[var][states]
+    elif formula.type == "BINARY":
+        return applyBinary(formula.op, checkVector(formula.subformulas[0], states),
+                           checkVector(formula.subformulas[1], states))
+
+
+# applies binary operator op to the vectors vals1 and vals2
+def applyBinary(op, vals1, vals2):
+    if op.type == "AND":
+        return np.minimum(vals1, vals2)
+    if op.type == "OR":
+        return np.maximum(vals1, vals2)
+    if op.type == "PRODUCT":
+        return vals1 * vals2
+    if op.type == "COPRODUCT":
+        return vals1 + vals2 - vals1 * vals2
+    if op.type == "TCOSUM":
+        return np.maximum(0.0, vals1 + vals2 - 1.0)
+    if op.type == "TSUM":
+        return np.minimum(1.0, vals1 + vals2)
+    if op.type == "LAMBDA":
+        return op.val * vals1 + (1.0 - op.val) * vals2
+
+
+# applies a diamond (or box) with the given action to the vector vals of all states
+def applyModality(action, isDiamond, vals):
+    result = np.full(model.numstates, 0.0 if isDiamond else 1.0)
+    matrix = actionMatrix(action)
+    if matrix is not None:
+        entryProbs, entryTargets, rowStart, matrixStates, stateStart, stateRowStart = matrix
+        sums = np.add.reduceat(entryProbs * vals[entryTargets], rowStart[:-1])
+        if isDiamond:
+            result[matrixStates] = np.maximum(np.maximum.reduceat(sums, stateStart), 0.0)
+        else:
+            result[matrixStates] = np.minimum(np.minimum.reduceat(sums, stateStart), 1.0)
+    return result
+
+
+# interval iteration approximates every fixpoint from below (starting at 0) and from above (starting at 1)
+# for fixpoints mu X.(<a1>X || ... || <an>X || f) with X not in f, the upper bound gets stuck in end components of the
+#   actions a1..an, where a strategy can stay forever: there the least fixpoint is the best value of leaving the end
+#   component, either by f or by a transition that leaves it (dually for nu X.([a1]X && ... && [an]X && f))
+# collects for every such fixpoint variable its maximal end components and the closed part f
+def collectEndComponents(formula):
+    if formula.op.type in ["LEASTFP", "GREATESTFP"]:
+        actions, closed = reachabilityShape(formula)
+        if actions is not None:
+            mec, exitRows = maximalEndComponents(model, actions)
+            distStart = np.asarray(model.distStart)
+            counts = distStart[exitRows + 1] - distStart[exitRows]
+            entries = concatRanges(distStart[exitRows], counts)
+            exitSources = np.repeat(np.arange(model.numstates), np.diff(np.asarray(model.stateStart)))[exitRows]
+            endComponents[formula.op.var] = (mec, mec[exitSources], np.asarray(model.probs)[entries],
+                                  np.asarray(model.targets)[entries], np.cumsum(counts) - counts, closed)
+    for subformula in formula.subformulas:
+        collectEndComponents(subformula)
+
+
+# lowers the upper bound vals of a least fixpoint (or raises the lower bound of a greatest fixpoint) in every end
+#   component to the best value of leaving it, where closedVals are the values of the closed part
+def tightenEndComponents(var, vals, closedVals, isMu):
+    mec, exitMec, exitProbs, exitTargets, exitRowStart, closed = endComponents[var]
+    inMec = mec >= 0
+    if not inMec.any():
+        return vals
+    exitVals = np.add.reduceat(exitProbs * vals[exitTargets], exitRowStart) if len(exitMec) else np.zeros(0)
+    if isMu:
+        best = np.zeros(mec.max() + 1)
+        np.maximum.at(best, mec[inMec], closedVals[inMec])
+        np.maximum.at(best, exitMec, exitVals)
+        vals[inMec] = np.minimum(vals[inMec], best[mec[inMec]])
+    else:
+        best = np.ones(mec.max() + 1)
+        np.minimum.at(best, mec[inMec], closedVals[inMec])
+        np.minimum.at(best, exitMec, exitVals)
+        vals[inMec] = np.maximum(vals[inMec], best[mec[inMec]])
+    return vals
+
+
+# evaluates formula for all states at once by interval iteration and returns a vector of lower and upper bounds
+# if atInit, fixpoint iteration stops when the bounds of the initial state are closer than epsilon, else when the
+#   bounds of all states are, or when they (almost) no longer change
+def checkInterval(formula, atInit=False):
+    if formula.type == "NULLARY":
+        if formula.op.type == "VAL":
+            vals = np.full(model.numstates, formula.op.val)
+            return vals, vals
+        elif formula.op.type == "VAR":
+            return lowerVariables[formula.op.var], upperVariables[formula.op.var]
+        elif formula.op.type == "LABEL":
+            labels = np.asarray(model.labels, dtype=float)
+            return labels, labels
+    elif formula.type == "UNARY":
+        if formula.op.type in ["DIAMOND", "BOX"]:
+            lower, upper = checkInterval(formula.subformulas[0])
+            isDiamond = formula.op.type == "DIAMOND"
+            return applyModality(formula.op.action, isDiamond, lower), applyModality(formula.op.action, isDiamond, upper)
+        elif formula.op.type in ["LEASTFP", "GREATESTFP"]:
+            var = formula.op.var
+            isMu = formula.op.type == "LEASTFP"
+            lowerVariables[var] = np.zeros(model.numstates)
+            upperVariables[var] = np.ones(model.numstates)
+            if var in endComponents:
+                closed = endComponents[var][-1]
+                closedVals = np.full(model.numstates, 0.0 if isMu else 1.0)
+                for subformula in closed:
+                    lower, upper = checkInterval(subformula)
+                    closedVals = np.maximum(closedVals, upper) if isMu else np.minimum(closedVals, lower)
+            i = 0
+            while maxIter is None or i < maxIter:
+                lower, upper = checkInterval(formula.subformulas[0])
+                if var in endComponents:
+                    if isMu:
+                        upper = tightenEndComponents(var, upper.copy(), closedVals, True)
+                    else:
+                        lower = tightenEndComponents(var, lower.copy(), closedVals, False)
+                # both are bounds, so we keep the best of the old and new ones
+                lower = np.maximum(lower, lowerVariables[var])
+                upper = np.minimum(upper, upperVariables[var])
+                residual = max(np.max(lower - lowerVariables[var]), np.max(upperVariables[var] - upper))
+                lowerVariables[var] = lower
+                upperVariables[var] = upper
                 i += 1
-            return variables[var][state]
+                gap = upper[model.initstate] - lower[model.initstate] if atInit else np.max(upper - lower)
+                if printInfo:
+                    print("Iteration " + str(i) + " of " + var + ": gap " + str(gap) + ", residual " + str(residual))
+                # the bounds may get stuck (e.g. in end components of other fixpoints), then we stop as well
+                if gap < epsilon or residual < epsilon * epsilon:
+                    break
+            iterations[var] += i
+            residuals[var] = max(residuals[var], residual)
+            gaps[var] = max(gaps[var], gap)
+            return lowerVariables[var], upperVariables[var]
     elif formula.type == "BINARY":
-        val1 = checkNaive(formula.subformulas[0], state)
-        val2 = checkNaive(formula.subformulas[1], state)
-        if formula.op.type == "AND":
-            return min(val1, val2)
-        if formula.op.type == "OR":
-            return max(val1, val2)
-        if formula.op.type == "PRODUCT":
-            return val1 * val2
-        if formula.op.type == "COPRODUCT":
-            return val1 + val2 - val1 * val2
-        if formula.op.type == "TCOSUM":
-            return max(0.0, val1 + val2 - 1.0)
-        if formula.op.type == "TSUM":
-            return min(1.0, val1 + val2)
-        if formula.op.type == "LAMBDA":
-            return formula.op.val * val1 + (1.0 - formula.op.val) * val2
-
-
-def checkNaiveInit(ts, formula, verbose):
-    global model, variables, printInfo
+        lower1, upper1 = checkInterval(formula.subformulas[0])
+        lower2, upper2 = checkInterval(formula.subformulas[1])
+        return applyBinary(formula.op, lower1, lower2), applyBinary(formula.op, upper1, upper2)
+
+
+# with interval, fixpoints are approximated by interval iteration (see checkInterval) and the bounds of the result are
+#   stored in 'bounds', the returned value is the middle of the bounds if they are closer than precision
+def checkVectorInit(ts, formula, verbose, precision=EPSILON, inPlace=False, maximumIterations=MAXITER, interval=False):
+    global model, variables, printInfo, epsilon, gaussSeidel, maxIter, actionMatrices, resets, iterations, residuals, gaps
+    global stateBlocks
+    global lowerVariables, upperVariables, endComponents, bounds
     model = ts
     printInfo = verbose
-    variables = {var: [] for var in formula.vars}
+    epsilon = precision
+    gaussSeidel = inPlace
+    maxIter = maximumIterations
+    actionMatrices = {}
+    variables = {var: None for var in formula.vars}
+    resets = {}
+    collectResets(formula)
+    iterations = {var: 0 for var in formula.vars}
+    residuals = {var: 0.0 for var in formula.vars}
+    gaps = {var: 0.0 for var in formula.vars}
+    lowerVariables = {}
+    upperVariables = {}
+    endComponents = {}
+    bounds = None
     start = time.clock()
-    value = checkNaive(formula, model.initstate)
+    if interval:
+        collectEndComponents(formula)
+        lower, upper = checkInterval(formula, True)
+        bounds = (float(lower[model.initstate]), float(upper[model.initstate]))
+        if bounds[1] - bounds[0] < epsilon:
+            value = (bounds[0] + bounds[1]) / 2
+        else:
+            # the bounds got stuck, so we fall back to the usual approximation (which lies between them)
+            stateBlocks = createStateBlocks() if gaussSeidel else []
+            value = min(max(float(checkVector(formula)[model.initstate]), bounds[0]), bounds[1])
+    else:
+        stateBlocks = createStateBlocks() if gaussSeidel else []
+        value = float(checkVector(formula)[model.initstate])
     end = time.clock()
     return value, end - start
@@ -0,0 +1,208 @@
+# checks that the engines and options added to the checker agree with the result of the RES solver (-e) on the
+#   examples, for formulas that are given here or read from the formula files next to the models
+
+import os
+import pytest
+from TSReader import readTS
+from FormulaReader import getAST, readFormula
+import plmuChecker
+import RESSolver
+import BESSolver
+import ParityGameCreator
+import ParityGamePreprocessor
+import ParityGameSolver
+from ParityGame import NATURE
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+# the results of the approximating engines may differ this much from the exact result
+TOLERANCE = 1e-6
+# the operators that not every engine supports, formulas with them are left out
+UNSUPPORTED = ["LABEL", "PRODUCT", "COPRODUCT", "TCOSUM", "TSUM"]
+
+# probabilistic models with the formulas to check on them
+PROBABILISTIC = [("boardgame/board3x1nd.txt", "boardgame/formulas-boardgamend.txt"),
+                 ("boardgame/board3x3nd.txt", "boardgame/formulas-boardgamend.txt"),
+                 ("boardgame/board3x3.txt", "boardgame/formulas-boardgame.txt"),
+                 ("selfloop/probselfloop.txt", "selfloop/formulas-selfloop.txt"),
+                 ("diceAB/diceABnon-det.txt", "diceAB/formulas-non-det.txt"),
+                 ("diceAB/dieAasB.txt", "diceAB/formulas-AasB.txt"),
+                 ("brp/brp-2-4.aut", "brp/formulas-brp.txt")]
+# non-probabilistic models, on which the formulas of NONPROBABILISTIC_FORMULAS are checked as well
+NONPROBABILISTIC = [("bestest/slide9.txt", "bestest/formula-slide9.txt"),
+                    ("bestest/slide10.txt", "bestest/formula-slide10.txt"),
+                    ("bestest/slide19.txt", "bestest/formula-slide19.txt"),
+                    ("selfloop/non-detselfloop.txt", "selfloop/formulas-selfloop.txt")]
+NONPROBABILISTIC_FORMULAS = ["mu X.(<b>1 || <a>X)", "nu X.<a>X", "mu X.([a]X || [b]X)",
+                             "nu X.([a]X && nu Y.mu Z.(<b>Y || <a>Z))", "nu X.(mu Y.(<b>Y || <a>X) && [a]X)"]
+# reachability formulas whose closed part is not only 0 or 1, per model, for the graph analysis of qualitative states
+QUALITATIVE_FORMULAS = {"boardgame/board3x3nd.txt": ["mu X.(<move>X || <won>0.5)", "nu X.([move]X && [lost]0.5)",
+                                                     "mu X.(<move>X || <won>1 || <lost>0.5)"],
+                        "boardgame/board3x3.txt": ["mu X.(<moveLeft>X || <moveRight>X || <won>0.5)",
+                                                   "nu X.([moveLeft]X && [moveRight]X && [won]0.25 && [lost]1)"]}
+
+models = {}
+expectedValues = {}
+
+
+# gives the model in file name of the examples, which is read once
+def readModel(name):
+    if name not in models:
+        models[name] = readTS(os.path.join(EXAMPLES, name))
+    return models[name]
+
+
+# gives the model in file name with the formulas in formulaFile that all engines support, for non-probabilistic
+#   models together with NONPROBABILISTIC_FORMULAS
+def readCase(name, formulaFile):
+    ts = readModel(name)
+    formulas = readFormula(os.path.join(EXAMPLES, formulaFile))
+    if not ts.isProbabilistic:
+        formulas += [getAST(formula) for formula in NONPROBABILISTIC_FORMULAS]
+    return ts, [formula for formula in formulas if not formula.getSubFormulas(UNSUPPORTED)]
+
+
+# gives the result of the RES solver, the baseline for the other engines
+def expectedValue(ts, formula):
+    key = (ts.file, str(formula))
+    if key not in expectedValues:
+        expectedValues[key] = RESSolver.initRESSolver(ts, formula, False, False, False, False, False)[0]
+    return expectedValues[key]
+
+
+# checks value, and the bounds if given, against the result of the RES solver
+def checkValue(ts, formula, value, bounds=None):
+    expected = expectedValue(ts, formula)
+    assert value == pytest.approx(expected, abs=TOLERANCE), str(formula)
+    if bounds is not None:
+        assert bounds[0] - TOLERANCE <= expected <= bounds[1] + TOLERANCE, str(formula)
+
+
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testPolicyIteration(name, formulaFile):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        checkValue(ts, formula, RESSolver.initRESSolver(ts, formula, False, False, True, True, True, True)[0])
+
+
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testNumericEngine(name, formulaFile):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        value = RESSolver.initRESSolver(ts, formula, False, False, True, True, True, engine="numeric")[0]
+        checkValue(ts, formula, value, RESSolver.bounds)
+
+
+@pytest.mark.parametrize("inPlace", [False, True])
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testIntervalIteration(name, formulaFile, inPlace):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        value = plmuChecker.checkVectorInit(ts, formula, False, inPlace=inPlace, interval=True)[0]
+        checkValue(ts, formula, value, plmuChecker.bounds)
+
+
+# the fallback of interval iteration used to leave no blocks for Gauss-Seidel iteration, so nothing was updated
+@pytest.mark.parametrize("name", ["bestest/slide10.txt", "bestest/slide19.txt"])
+def testIntervalGaussSeidel(name):
+    ts = readModel(name)
+    formula = getAST("nu X.([a]X && nu Y.mu Z.(<b>Y || <a>Z))")
+    value = plmuChecker.checkVectorInit(ts, formula, False, inPlace=True, interval=True)[0]
+    checkValue(ts, formula, value)
+
+
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testQualitative(name, formulaFile):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas + [getAST(formula) for formula in QUALITATIVE_FORMULAS.get(name, [])]:
+        value = RESSolver.initRESSolver(ts, formula, False, False, False, False, False, qualitative=True)[0]
+        checkValue(ts, formula, value)
+
+
+@pytest.mark.parametrize("local", [False, True])
+@pytest.mark.parametrize("name, formulaFile", NONPROBABILISTIC)
+def testBES(name, formulaFile, local):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        checkValue(ts, formula, float(BESSolver.initBESSolver(ts, formula, False, False, local)[0]))
+
+
+# a BES written as with -s is read back and solved
+@pytest.mark.parametrize("name, formulaFile", NONPROBABILISTIC)
+def testStoredBES(name, formulaFile, tmp_path):
+    ts, formulas = readCase(name, formulaFile)
+    BESSolver.model = ts
+    for i, formula in enumerate(formulas):
+        fileName = str(tmp_path / ("formula" + str(i) + ".bes"))
+        bes = BESSolver.createBES(formula)
+        f = open(fileName, 'w')
+        f.write(str(bes))
+        f.close()
+        # the flat right-hand sides over integer variables are read back as they were written
+        assert str(BESSolver.readBES(fileName)) == str(bes)
+        checkValue(ts, formula, float(BESSolver.initStoredBESSolver(fileName, False)[1]))
+
+
+@pytest.mark.parametrize("fromRES", [False, True])
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testParityGame(name, formulaFile, fromRES):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        isProbabilistic = ts.isProbabilistic or formula.isOnlyProbabilistic
+        value = ParityGameCreator.initParityGameCreator(ts, formula, fromRES, False, False, isProbabilistic)[0]
+        checkValue(ts, formula, value, ParityGameSolver.bounds)
+
+
+# gives the parity game of formula on ts as it is created and reduced, before preprocessing
+def createParityGame(ts, formula):
+    ParityGameCreator.model = ts
+    return ParityGameCreator.reduceParityGame(ParityGameCreator.createParityGameFromPLmu(formula, ts.isProbabilistic))
+
+
+# every node of a game has successors in the game, and the probabilities of the successors of a NATURE node add up to 1
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testParityGameArrays(name, formulaFile):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        game = createParityGame(ts, formula)
+        assert len(game.ranks) == game.numnodes and len(game.succStart) == game.numnodes + 1
+        assert len(game.succ) == len(game.probs) == game.succStart[-1]
+        for node in range(game.numnodes):
+            successors = game.successors(node).tolist()
+            assert successors and all(0 <= succ < game.numnodes for succ in successors)
+            if game.owners[node] == NATURE:
+                assert sum(game.probabilities(node)) == pytest.approx(1.0)
+
+
+# the .gm file of a game has a line per node with its priority, owner and successors (with their probabilities for
+#   NATURE nodes), where the priority keeps the parity of the rank
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC[:2] + NONPROBABILISTIC)
+def testGM(name, formulaFile, tmp_path):
+    ts, formulas = readCase(name, formulaFile)
+    for i, formula in enumerate(formulas):
+        game = createParityGame(ts, formula)
+        fileName = str(tmp_path / ("formula" + str(i) + ".gm"))
+        game.toGM(fileName)
+        lines = open(fileName).read().splitlines()
+        assert lines[:2] == ["parity " + str(game.numnodes - 1) + ";", "start " + str(game.initNode) + ";"]
+        assert len(lines) == game.numnodes + 2
+        for node, line in enumerate(lines[2:]):
+            fields = line.rstrip(";").split(" ")
+            assert int(fields[0]) == node
+            assert int(fields[1]) % 2 == game.ranks[node] % 2 and int(fields[2]) == game.owners[node]
+            successors = [successor.split(":") for successor in fields[3].split(",")]
+            assert [int(successor[0]) for successor in successors] == game.successors(node).tolist()
+            if game.owners[node] == NATURE:
+                assert [float(successor[1]) for successor in successors] == game.probabilities(node).tolist()
+
+
+# preprocessing gives a game with the same value for the initial node
+@pytest.mark.parametrize("name, formulaFile", PROBABILISTIC + NONPROBABILISTIC)
+def testPreprocessing(name, formulaFile):
+    ts, formulas = readCase(name, formulaFile)
+    for formula in formulas:
+        game = createParityGame(ts, formula)
+        value = ParityGameSolver.solveParityGame(game)
+        checkValue(ts, formula, value)
+        preprocessed = ParityGamePreprocessor.preprocessParityGame(game)
+        assert preprocessed.numnodes <= game.numnodes
+        checkValue(ts, formula, ParityGameSolver.solveParityGame(preprocessed))